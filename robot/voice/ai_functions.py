@@ -1,6 +1,7 @@
-import requests
 import json
 import os
+import threading
+from contextlib import contextmanager
 from gtts import gTTS
 import pygame
 import time
@@ -9,30 +10,92 @@ from fuzzywuzzy import fuzz
 
 from dotenv import load_dotenv
 
+from context_window import ContextWindow
+from conversation_store import ConversationStore
+import network_monitor
+import voice_feedback
+from llm_client import LLMClient, LLMCancelled, LLMDeadlineExceeded, LLMError, create_backend
+from response_cache import ResponseCache
+from sampling_profiler import profiled
+
 load_dotenv()
 
 # Mistral AI API settings
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
-HISTORY_FILE = "conversation_history.json"
 CONFIG_FILE = "ai_config.json"
 
 # Default AI settings
 default_ai_config = {
     "response_style": "short",  # Can be "short" or "detailed"
+    "backend": "mistral",  # Can be "mistral" or "mock" (see mock_llm_server.py)
+    "mock_url": "http://127.0.0.1:8089/v1/chat/completions",
+    "request_deadline": 20,  # Seconds an AI request may take before it is abandoned
+    "connect_timeout": 5,  # Seconds to wait for the connection to the AI backend
+    "context_token_budget": 2000,  # Max estimated tokens of history sent per request
+    "summary_refresh_messages": 6,  # Folded messages needed before the summary is regenerated
+    "response_cache_enabled": False,  # Reuse answers (and their audio) for repeated prompts
+    "response_cache_size": 100,  # Max number of cached answers
+    "response_cache_ttl": 86400,  # Seconds a cached answer stays valid
+    # Prompts containing any of these phrases are always sent to the AI
+    "response_cache_opt_out": ["time", "date", "today", "tonight", "tomorrow", "yesterday",
+                               "now", "latest", "news", "weather"],
 }
 
+# In-memory copy of the AI configuration and the file state it was read from
+_ai_config = None
+_ai_config_mtime = None
+
+# In-memory conversation history backed by an append-only log
+_conversation_store = None
+
+# Keeps the request within the token budget, created on first use
+_context_window = None
+
+# Answers to repeated prompts, created on first use when enabled
+_response_cache = None
+
+# Streaming client for the configured AI backend, created on first use
+_llm_client = None
+
+# Speech of the answer being spoken, stopped when the user issues a new command
+_active_pipeline = None
+
+# State of the assistant daemon session served by the current thread, see session_context
+_session = threading.local()
+
+def _on_network_change(online):
+    global _network_online
+    _network_online = online
+
+
+# Connectivity as last reported by the network monitor
+_network_online = network_monitor.subscribe(_on_network_change)
+
 # Function to load AI configuration
 def load_ai_config():
-    if os.path.exists(CONFIG_FILE):
+    global _ai_config, _ai_config_mtime
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return default_ai_config
+    # Only re-parse the file when it changed on disk
+    if _ai_config is None or mtime != _ai_config_mtime:
         with open(CONFIG_FILE, "r", encoding="utf-8") as file:
-            return json.load(file)
-    return default_ai_config
+            _ai_config = json.load(file)
+        _ai_config_mtime = mtime
+    return _ai_config
 
 # Function to save AI configuration
 def save_ai_config(config):
+    global _ai_config, _ai_config_mtime
     with open(CONFIG_FILE, "w", encoding="utf-8") as file:
         json.dump(config, file, ensure_ascii=False, indent=4)
+    _ai_config = config
+    _ai_config_mtime = os.stat(CONFIG_FILE).st_mtime_ns
+
+# Function to read a setting, falling back to its default
+def get_ai_setting(ai_config, key):
+    return ai_config.get(key, default_ai_config[key])
 
 # Function to get appropriate system message based on response style
 def get_system_message(style):
@@ -41,34 +104,149 @@ def get_system_message(style):
     else:  # detailed
         return "You are a helpful assistant that provides detailed and comprehensive responses."
 
-# Function to load conversation history from a file
-def load_conversation_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r", encoding="utf-8") as file:
-            return json.load(file)
-    # Initialize with different system messages based on the current response style
-    ai_config = load_ai_config()
-    system_message = get_system_message(ai_config["response_style"])
-    return [{"role": "system", "content": system_message}]
+# Function to answer on this thread with the history, context window, AI client
+# and answer in progress of an assistant daemon session instead of the shared ones
+@contextmanager
+def session_context(store, context_window, llm_client=None):
+    previous = getattr(_session, 'state', None)
+    _session.state = {"store": store, "context_window": context_window, "llm_client": llm_client,
+                      "pipeline": None}
+    try:
+        yield
+    finally:
+        _session.state = previous
+
+# Function to get the conversation store, created on first use
+def get_conversation_store():
+    global _conversation_store
+    session = getattr(_session, 'state', None)
+    if session is not None:
+        return session["store"]
+    if _conversation_store is None:
+        _conversation_store = ConversationStore()
+    return _conversation_store
 
-# Function to save conversation history to a file
-def save_conversation_history(history):
-    with open(HISTORY_FILE, "w", encoding="utf-8") as file:
-        json.dump(history, file, ensure_ascii=False, indent=4)
+# Function to get the response cache, or None when it is disabled
+def get_response_cache(ai_config):
+    global _response_cache
+    if not get_ai_setting(ai_config, "response_cache_enabled"):
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(get_ai_setting(ai_config, "response_cache_size"),
+                                        get_ai_setting(ai_config, "response_cache_ttl"),
+                                        get_ai_setting(ai_config, "response_cache_opt_out"))
+    return _response_cache
+
+# Function to create a client for the configured AI backend
+def create_llm_client(ai_config=None):
+    if ai_config is None:
+        ai_config = load_ai_config()
+    backend = create_backend(get_ai_setting(ai_config, "backend"), MISTRAL_API_KEY,
+                             get_ai_setting(ai_config, "mock_url"))
+    return LLMClient(backend, get_ai_setting(ai_config, "request_deadline"),
+                     get_ai_setting(ai_config, "connect_timeout"))
+
+# Function to get the AI client, created on first use
+def get_llm_client(ai_config=None):
+    global _llm_client
+    session = getattr(_session, 'state', None)
+    if session is not None and session["llm_client"] is not None:
+        return session["llm_client"]
+    if _llm_client is None:
+        _llm_client = create_llm_client(ai_config)
+    return _llm_client
+
+# Function to keep the speech of the answer in progress, of this thread's daemon session if any
+def set_active_pipeline(pipeline):
+    global _active_pipeline
+    session = getattr(_session, 'state', None)
+    if session is not None:
+        session["pipeline"] = pipeline
+    else:
+        _active_pipeline = pipeline
+
+# Function to cancel the AI request and speech in progress, if any
+def cancel_active_request():
+    global _active_pipeline
+    session = getattr(_session, 'state', None)
+    if session is not None:
+        client = session["llm_client"]
+        pipeline, session["pipeline"] = session["pipeline"], None
+    else:
+        client = _llm_client
+        pipeline, _active_pipeline = _active_pipeline, None
+    cancelled = client is not None and client.cancel_active()
+    if pipeline is not None:
+        pipeline.cancel()
+    return cancelled
+
+# Function to answer a prompt without blocking the listening loop; a daemon session
+# collecting its speech gets the answer inline, so it can be sent back with the result
+def chat_in_background(prompt):
+    if voice_feedback.capturing_speech():
+        chat_with_mistral(prompt)
+        return None
+    thread = threading.Thread(target=chat_with_mistral, args=(prompt,), daemon=True)
+    thread.start()
+    return thread
+
+# Function to get the context window builder, created on first use
+def get_context_window():
+    session = getattr(_session, 'state', None)
+    if session is not None:
+        return session["context_window"]
+    global _context_window
+    if _context_window is None:
+        _context_window = ContextWindow(summarize_conversation)
+    return _context_window
+
+# Function to summarize turns that no longer fit in the context window
+def summarize_conversation(messages, previous_summary=""):
+    """
+    Asks Mistral for a short summary of @messages, extending @previous_summary.
+    Returns None if the summary could not be generated.
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    if previous_summary:
+        transcript = f"Summary so far: {previous_summary}\n{transcript}"
+    payload = {
+        "messages": [
+            {"role": "system", "content": "Summarize the conversation below in a few sentences. "
+                                          "Keep names, facts and user preferences."},
+            {"role": "user", "content": transcript}
+        ],
+        "max_tokens": 150,
+        "temperature": 0.0
+    }
+    try:
+        return get_llm_client().complete(payload)
+    except LLMError as e:
+        print(f"Unable to summarize conversation: {e}")
+        return None
+
+# Function to load conversation history from the store
+def load_conversation_history(ai_config=None):
+    store = get_conversation_store()
+    history = store.get_history()
+    if history:
+        return history
+    # Initialize with different system messages based on the current response style
+    if ai_config is None:
+        ai_config = load_ai_config()
+    system_message = {"role": "system", "content": get_system_message(ai_config["response_style"])}
+    store.append(system_message)
+    return [system_message]
 
 # Function to toggle response style
 def toggle_response_style():
-    ai_config = load_ai_config()
+    ai_config = dict(load_ai_config())
     current_style = ai_config["response_style"]
     new_style = "detailed" if current_style == "short" else "short"
     ai_config["response_style"] = new_style
     save_ai_config(ai_config)
     
     # Update the system message in the conversation history
-    history = load_conversation_history()
-    if history and history[0]["role"] == "system":
-        history[0]["content"] = get_system_message(new_style)
-        save_conversation_history(history)
+    get_conversation_store().set_system_message(get_system_message(new_style))
     
     return new_style
 
@@ -98,16 +276,23 @@ def is_fuzzy_command_match(text, commands, threshold=80):
 
 # Import the speak function from voice_feedback
 from voice_feedback import speak
+from speech_pipeline import SentenceSplitter, SpeechPipeline
 
+@profiled('ai')
 def chat_with_mistral(prompt):
     """
-    Sends a message to Mistral AI and displays chunks as they arrive.
-    In short mode: speaks only the first complete sentence.
+    Sends a message to the AI backend (Mistral by default) and displays chunks as they arrive.
+    Each sentence is spoken as soon as it is complete.
+    In short mode: speaks only the first complete sentence and closes the stream.
     In detailed mode: speaks the entire response.
-    Returns the full response string.
+    Returns the full response string, or None if the request was cancelled.
     """
+    # Load current AI config to determine response style
+    current_config = load_ai_config()
+    response_style = current_config["response_style"]
+
     # Load the conversation history at the beginning of each call
-    conversation_history = load_conversation_history()
+    conversation_history = load_conversation_history(current_config)
     
     # List of commands to toggle response style
     toggle_commands = ["toggle response style", "switch response style", "change response style"]
@@ -121,103 +306,126 @@ def chat_with_mistral(prompt):
         return response_msg
     
     # Add the user's message to the history
-    conversation_history.append({"role": "user", "content": prompt})
+    user_message = {"role": "user", "content": prompt}
+    conversation_history.append(user_message)
     
-    # Load current AI config to determine response style
-    current_config = load_ai_config()
-    response_style = current_config["response_style"]
-    
-    # Request headers
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "text/event-stream"
-    }
+    # Repeated prompts are answered from the cache without an AI request
+    response_cache = get_response_cache(current_config)
+    if response_cache is not None:
+        cached_response = response_cache.get(prompt, response_style)
+        if cached_response is not None:
+            print(f"Assistant (cached): {cached_response}")
+            # The sentences are the same as when the answer was streamed,
+            # so their audio comes straight from the voice feedback cache
+            splitter = SentenceSplitter()
+            sentences = splitter.feed(cached_response) + [splitter.flush()]
+            if response_style == "short":
+                sentences = sentences[:1]
+            pipeline = SpeechPipeline()
+            set_active_pipeline(pipeline)
+            for sentence in sentences:
+                if sentence:
+                    pipeline.say(sentence)
+            pipeline.close(wait=False)
+            store = get_conversation_store()
+            store.append(user_message)
+            store.append({"role": "assistant", "content": cached_response})
+            return cached_response
     
+    # Fail fast instead of waiting for the connect timeout, the mock server is local
+    if not _network_online and current_config.get("backend") != "mock":
+        error_msg = "I can't reach the AI service without a network connection."
+        print(f"Assistant: {error_msg}")
+        speak(error_msg)
+        return error_msg
+
     # Adjust max_tokens based on response style
     max_tokens = 35 if response_style == "short" else 200
     
+    # Only the system message and the latest turns that fit the budget are sent
+    messages, token_count = get_context_window().build(
+        conversation_history,
+        get_ai_setting(current_config, "context_token_budget"),
+        get_ai_setting(current_config, "summary_refresh_messages")
+    )
+    
     # Request payload
     payload = {
-        "model": "mistral-medium",
-        "messages": conversation_history,
+        "messages": messages,
         "max_tokens": max_tokens,
         "temperature": 0.2,
-        "top_p": 0.9,
-        "stream": True
+        "top_p": 0.9
     }
     
-    # Send the request to the API
-    response = requests.post(
-        MISTRAL_API_URL,
-        headers=headers,
-        json=payload,
-        stream=True
-    )
+    # Send the request to the AI backend, it runs on its own thread and
+    # is cancelled if the user issues a new command meanwhile
+    request = get_llm_client(current_config).stream(payload)
+    print(f"[context] {len(messages)}/{len(conversation_history)} messages, "
+          f"~{token_count} tokens, {len(request.body)} bytes")
     
-    if response.status_code == 200:
-        full_response = ""
-        
-        # For short mode: track first sentence only
-        current_sentence = ""
-        first_sentence_spoken = False
-        
-        print("Assistant: ", end="", flush=True)
-        
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith("data: "):
-                    data = line[6:]
-                    
-                    if data == "[DONE]":
-                        continue
-                    
-                    try:
-                        json_data = json.loads(data)
-                        content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        
-                        if content:
-                            # Print the content incrementally
-                            print(content, end="", flush=True)
-                            
-                            # Add to full response
-                            full_response += content
-                            
-                            # Different behavior based on response style
-                            if response_style == "short":
-                                # In short mode, only speak the first sentence
-                                if not first_sentence_spoken:
-                                    current_sentence += content
-                                    
-                                    # Check if we have a complete sentence ending with a period
-                                    if current_sentence.strip().endswith("."):
-                                        speak(current_sentence.strip())
-                                        first_sentence_spoken = True
-                            
-                    except json.JSONDecodeError:
-                        continue
-        
-        print()  # New line after response is complete
-        
-        if response_style == "short":
-            # Short mode: Handle any remaining text if first sentence not spoken
-            if current_sentence.strip() and not first_sentence_spoken:
-                speak(current_sentence.strip())
+    full_response = ""
+    
+    # Sentences are synthesized and spoken while later tokens are still arriving
+    splitter = SentenceSplitter()
+    pipeline = SpeechPipeline()
+    set_active_pipeline(pipeline)
+    first_sentence_spoken = False
+    
+    print("Assistant: ", end="", flush=True)
+    
+    try:
+        for content in request:
+            # Print the content incrementally
+            print(content, end="", flush=True)
+            
+            # Add to full response
+            full_response += content
+            
+            for sentence in splitter.feed(content):
+                pipeline.say(sentence)
+                first_sentence_spoken = True
+                # In short mode, only the first sentence is spoken
+                if response_style == "short":
+                    break
+            
+            # Nothing else will be spoken, stop reading the stream
+            if response_style == "short" and first_sentence_spoken:
+                request.cancel()
+                break
+    except LLMCancelled:
+        print()
+        pipeline.cancel()
+        return None
+    except LLMError as e:
+        print()
+        pipeline.cancel()
+        if isinstance(e, LLMDeadlineExceeded):
+            error_msg = f"AI request timed out: {e}"
         else:
-            # Detailed mode: Speak the entire response
-            speak(full_response.strip())
-        
-        # Add the AI's complete response to the history
-        conversation_history.append({"role": "assistant", "content": full_response})
-        save_conversation_history(conversation_history)
-        
-        return full_response
-    else:
-        error_msg = f"Error querying the API: {response.status_code} - {response.text}"
+            error_msg = f"Error querying the API: {e}"
+        # The network may have gone down since the last probe
+        network_monitor.monitor.recheck()
         print(error_msg)
         speak("Sorry, I encountered an error when trying to get a response.")
         return error_msg
+    
+    print()  # New line after response is complete
+    
+    # Speak whatever is left once the stream has ended
+    rest = splitter.flush()
+    if rest and (response_style != "short" or not first_sentence_spoken):
+        pipeline.say(rest)
+    pipeline.close(wait=False)
+    
+    if response_cache is not None:
+        response_cache.put(prompt, response_style, full_response)
+    
+    # Add the turn to the history, only the two new messages are written
+    store = get_conversation_store()
+    store.append(user_message)
+    store.append({"role": "assistant", "content": full_response})
+    
+    return full_response
 
 if __name__ == "__main__":
     print("Welcome to the Mistral AI chat! Type 'exit' to quit.")
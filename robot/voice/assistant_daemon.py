@@ -0,0 +1,225 @@
+import atexit
+import os
+import re
+import socketserver
+import threading
+
+import click
+import torch
+import whisper
+from termcolor import cprint
+
+import ai_functions
+import basic_mode_manager
+import command_manager
+import config_manager
+import master_mode_manager
+import metrics
+import network_monitor
+import recognition
+import voice_feedback
+from context_window import ContextWindow, SUMMARY_FILE
+from conversation_store import ConversationStore, HISTORY_LOG_FILE
+from daemon_protocol import COMMAND_STAGE, DEFAULT_SOCKET, HOT_WORD_STAGE, ProtocolError, recv_message, send_message
+
+# Serves several rooms from one process: every capture client (capture_client.py) streams
+# its recorded segments over a UNIX socket and gets back the transcript, the actions taken
+# and the synthesized speech to play, while the Whisper, speaker and TTS models are loaded once.
+#
+# usage (from robot/voice):
+#   python3 assistant_daemon.py --model base
+#   python3 capture_client.py --room kitchen
+
+SESSIONS_DIR = 'sessions'  # per room conversation history and summary
+
+
+def log(text, color=None, attrs=None):
+    if attrs is None:
+        attrs = []
+    if color is None:
+        print(text)
+    elif config_manager.config['logs']:
+        cprint(text, color, attrs=attrs)
+
+
+class Session:
+    """
+    The state of one room: its hot word stage, the config values it changed
+    (master mode), its conversation history and its AI client. Sessions
+    outlive their connection, so a client reconnecting to the same room
+    resumes where it left off.
+    """
+
+    def __init__(self, room):
+        self.room = room
+        self.stage = HOT_WORD_STAGE if config_manager.config['use-hot-word-in-basic-mode'] else COMMAND_STAGE
+        self.overrides = dict()
+        self.dispatch_state = dict()  # command_manager's internal variables for this room
+        self.lock = threading.Lock()
+        directory = os.path.join(SESSIONS_DIR, room)
+        os.makedirs(directory, exist_ok=True)
+        self.store = ConversationStore(os.path.join(directory, HISTORY_LOG_FILE), legacy_filename=None)
+        self.context_window = ContextWindow(ai_functions.summarize_conversation,
+                                            os.path.join(directory, SUMMARY_FILE))
+        self.llm_client = ai_functions.create_llm_client()
+
+    def handle_segment(self, audio_model, pcm, rate, channels, stage):
+        """
+        Runs a recorded segment through the same steps as the assistant's
+        listening loop, on this room's state.
+        @returns: (result dict, speech clips), result["quit"] is set when the
+                  room said the quit command
+        """
+        with self.lock, config_manager.session_overrides(self.overrides), \
+                voice_feedback.capture_speech() as clips, \
+                ai_functions.session_context(self.store, self.context_window, self.llm_client), \
+                command_manager.session_state(self.dispatch_state), \
+                command_manager.capture_actions() as actions:
+            quit_requested = False
+            hot_word = False
+            transcript = ''
+            try:
+                if stage == HOT_WORD_STAGE and config_manager.config.get('wake-plus-command', False):
+                    hot_word, transcript = recognition.transcribe_wake_and_command(audio_model, pcm, rate, channels)
+                    if transcript:
+                        # the command was said with the hot word, the room keeps waiting for hot words
+                        self._analyze_text(transcript)
+                    elif hot_word:
+                        voice_feedback.speak('Yes Master ...')
+                        self.stage = COMMAND_STAGE
+                elif stage == HOT_WORD_STAGE:
+                    transcript = recognition.transcribe_hot_word(audio_model, pcm, rate, channels)
+                    hot_word = basic_mode_manager.compare(transcript)
+                    if hot_word:
+                        voice_feedback.speak('Yes Master ...')
+                        self.stage = COMMAND_STAGE
+                else:
+                    transcript = recognition.transcribe_command(audio_model, pcm, rate, channels)
+                    if config_manager.config['use-hot-word-in-basic-mode']:
+                        self.stage = HOT_WORD_STAGE
+                    self._analyze_text(transcript)
+            except SystemExit:
+                # the quit command only ends this room's session
+                quit_requested = True
+            result = {'transcript': transcript, 'hot_word': hot_word, 'actions': actions,
+                      'stage': self.stage, 'quit': quit_requested}
+        return result, clips
+
+    def _analyze_text(self, text):
+        if text == '':
+            return
+        log(f'[{self.room}] You: {text}', "blue", attrs=["bold"])
+        # A new command supersedes this room's AI answer still streaming or being spoken
+        if ai_functions.cancel_active_request():
+            log(f'[{self.room}] Cancelled the previous AI request.', "yellow")
+        if text[-1] in " .!?":
+            text = text[:-1]
+        command_manager.launch_if_any(text)
+
+
+class AssistantDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, audio_model):
+        self.audio_model = audio_model
+        self.sessions = dict()
+        self.sessions_lock = threading.Lock()
+        super().__init__(socket_path, ClientHandler)
+
+    def get_session(self, room):
+        with self.sessions_lock:
+            if room not in self.sessions:
+                self.sessions[room] = Session(room)
+            return self.sessions[room]
+
+
+class ClientHandler(socketserver.BaseRequestHandler):
+    """Serves one capture client until it says bye or disconnects."""
+
+    def handle(self):
+        sock = self.request
+        try:
+            header, _ = recv_message(sock)
+            if header.get('type') != 'hello':
+                raise ProtocolError('expected hello')
+            room = re.sub(r'[^\w-]', '_', str(header.get('room') or 'default'))
+            rate = int(header.get('rate', config_manager.config['rate']))
+            channels = int(header.get('channels', config_manager.config['channels']))
+            session = self.server.get_session(room)
+            log(f'[{room}] client connected', "green")
+            send_message(sock, {'type': 'session', 'room': room, 'stage': session.stage})
+            while True:
+                header, payload = recv_message(sock)
+                if header.get('type') == 'bye':
+                    break
+                if header.get('type') != 'segment':
+                    raise ProtocolError(f"unexpected {header.get('type')!r} message")
+                with metrics.timer('daemon.segment'):
+                    result, clips = session.handle_segment(self.server.audio_model, payload, rate, channels,
+                                                           header.get('stage', session.stage))
+                for clip in clips:
+                    send_message(sock, {'type': 'audio', 'text': clip['text'], 'extension': clip['extension']},
+                                 clip['audio'])
+                send_message(sock, dict(result, type='result'))
+                if result['quit']:
+                    break
+        except EOFError:
+            pass
+        except (ProtocolError, ValueError) as e:
+            log(f'protocol error: {e}', "red")
+            try:
+                send_message(sock, {'type': 'error', 'message': str(e)})
+            except OSError:
+                pass
+        except OSError as e:
+            log(f'connection lost: {e}', "red")
+        log('client disconnected', "yellow")
+
+
+@click.command()
+@click.option("--model", default="base", help="Model to use",
+              type=click.Choice(["tiny", "base", "small", "medium", "large"]))
+@click.option("--socket", "socket_path", default=None, help="UNIX socket to listen on")
+def main(model, socket_path):
+    config_manager.init()
+    socket_path = socket_path or config_manager.config.get('daemon-socket', DEFAULT_SOCKET)
+
+    if config_manager.config['logs']:
+        atexit.register(metrics.report)
+
+    network_monitor.init(config_manager.config)
+    voice_feedback.init()
+
+    audio_model = whisper.load_model(model + ".en")
+    if torch.cuda.is_available():
+        audio_model = audio_model.to('cuda')
+        log("Using GPU for processing.", "green", attrs=["bold"])
+
+    command_manager.init()
+    voice_feedback.warm_up_cache(voice_feedback.get_static_speeches() + command_manager.get_static_speeches() + [
+        'Yes Master ...',
+    ])
+
+    if config_manager.config['master-mode']:
+        if master_mode_manager.canEnableMasterMode():
+            master_mode_manager.get_verifier(config_manager.config.get('master-mode-threshold', 0.25))
+        else:
+            config_manager.config['master-mode'] = False
+            log('MASTER MODE: DISABLED, configure it before using it', "red", attrs=['bold'])
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # left behind by a daemon that did not exit cleanly
+    server = AssistantDaemon(socket_path, audio_model)
+    log(f'🚀 Assistant daemon listening on {socket_path}', "blue")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import itertools
+import queue
+import sys
+import threading
+
+import metrics
+
+# Priorities, lower plays first: acknowledgements, command feedback, AI answers
+URGENT = 0
+NORMAL = 1
+ANSWER = 2
+
+
+class PlaybackJob:
+    """Something queued for playback; wait() blocks until it was played or dropped."""
+
+    def __init__(self, key, action, priority, group):
+        self.key = key
+        self.action = action
+        self.priority = priority
+        self.group = group
+        self.cancelled = False
+        self.preempted = False
+        self._done = threading.Event()
+
+    @property
+    def interrupted(self):
+        """True once the job should stop playing, checked by @action before it starts the player."""
+        return self.cancelled or self.preempted
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class AudioScheduler:
+    """
+    Plays everything through a single thread fed by a priority queue, so
+    overlapping callers neither cut each other off nor block. A job more
+    urgent than the one playing preempts it, and the preempted one starts
+    over afterwards; a job identical to the one queued right before it is
+    merged into it.
+    @stop_playback() must make the running action return promptly.
+    """
+
+    def __init__(self, stop_playback):
+        self._stop_playback = stop_playback
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._current = None
+        self._last = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, action, priority=NORMAL, group=None):
+        """
+        Queues @action(job) for playback, @key identifies its content for merging.
+        @returns: the job, possibly the one it was merged into
+        """
+        with self._lock:
+            last = self._last
+            if last is not None and last.key == key and not last.done and not last.cancelled:
+                metrics.increment("audio.merged")
+                return last
+            job = PlaybackJob(key, action, priority, group)
+            self._last = job
+            self._queue.put((priority, next(self._order), job))
+            current = self._current
+            if current is not None and priority < current.priority and not current.interrupted:
+                current.preempted = True
+                metrics.increment("audio.preempted")
+                self._stop_playback()
+        return job
+
+    @property
+    def current(self):
+        """The job playing, None when idle."""
+        return self._current
+
+    def flush(self):
+        """Drops everything queued and stops what is playing."""
+        self.cancel(lambda job: True)
+
+    def cancel_group(self, group):
+        """Drops the queued jobs of @group, stopping it if it is playing."""
+        self.cancel(lambda job: job.group is group)
+
+    def cancel(self, predicate):
+        with self._lock:
+            with self._queue.mutex:
+                pending = [job for _, _, job in self._queue.queue if predicate(job)]
+            for job in pending:
+                job.cancelled = True
+                job._done.set()
+            current = self._current
+            if current is not None and predicate(current):
+                current.cancelled = True
+                self._stop_playback()
+
+    def _run(self):
+        while True:
+            priority, order, job = self._queue.get()
+            with self._lock:
+                if job.cancelled:
+                    continue
+                self._current = job
+            try:
+                job.action(job)
+            except Exception as e:
+                print(f"📢 audio output failed: {e}", file=sys.stderr)
+            with self._lock:
+                self._current = None
+                if job.preempted and not job.cancelled:
+                    # Played again from the start once the urgent ones are done
+                    job.preempted = False
+                    self._queue.put((priority, order, job))
+                    continue
+            job._done.set()
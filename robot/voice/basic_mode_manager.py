@@ -1,3 +1,5 @@
+import re
+
 import config_manager
 
 def compare(text):
@@ -7,3 +9,32 @@ def compare(text):
     :return: comparison result
     """
     return text in config_manager.config['hot-words']
+
+
+def _words(text):
+    return [re.sub(r'[^a-z0-9]', '', word) for word in text.lower().split()]
+
+
+def strip_wake_phrase(text):
+    """
+    Removes the wake phrase the text starts with: any run of the hot words and the assistant's name,
+    as in "hey computer open firefox"
+    :param text: transcript of a hot word segment
+    :return: the rest of the text, None if it does not start with a wake phrase
+    """
+    phrases = [_words(phrase) for phrase in config_manager.config['hot-words'] + [config_manager.config['name']]]
+    phrases = [phrase for phrase in phrases if phrase]
+    words = text.split()
+    normalized = _words(text)
+    start = 0
+    matched = True
+    while matched:
+        matched = False
+        for phrase in phrases:
+            if normalized[start:start + len(phrase)] == phrase:
+                start += len(phrase)
+                matched = True
+                break
+    if start == 0:
+        return None
+    return ' '.join(words[start:]).strip(' ,.!?')
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Measures Whisper throughput when several sessions transcribe at once, with the
+# inference scheduler batching their utterances and with one utterance at a time
+# (--max-batch 1 equivalent). The audio is a pinned synthetic signal, so runs
+# are comparable; the transcripts themselves are meaningless.
+#
+# usage (from robot/voice): python3 benchmarks/asr_batching.py --model tiny --streams 1 4 16
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+from inference_scheduler import InferenceScheduler  # noqa: E402
+from transcription import WHISPER_RATE  # noqa: E402
+
+
+def synthetic_utterance(seconds, seed):
+    """@returns: a voiced-like signal, harmonics of a gliding pitch over light noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * WHISPER_RATE)) / WHISPER_RATE
+    pitch = 120 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / WHISPER_RATE
+    signal = sum(np.sin(k * phase) / k for k in range(1, 6)) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2)
+    signal += 0.02 * rng.standard_normal(len(t))
+    return (0.3 * signal / np.max(np.abs(signal))).astype(np.float32)
+
+
+def run(scheduler, streams, utterances, audio):
+    """@returns: (utterances per second, latency of every utterance)"""
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(streams + 1)
+
+    def session():
+        barrier.wait()
+        for _ in range(utterances):
+            started = time.perf_counter()
+            scheduler.submit(audio).future.result()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=session) for _ in range(streams)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return streams * utterances / (time.perf_counter() - started), latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Whisper batching throughput benchmark")
+    parser.add_argument("--model", default="tiny", choices=["tiny", "base", "small", "medium", "large"])
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--utterances", type=int, default=3, help="utterances per stream")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of each utterance")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-wait", type=float, default=0.01)
+    args = parser.parse_args()
+
+    import torch
+    import whisper
+
+    model = whisper.load_model(args.model + ".en")
+    if torch.cuda.is_available():
+        model = model.to('cuda')
+    audio = synthetic_utterance(args.seconds, seed=42)
+
+    batched = InferenceScheduler(model, args.max_batch, args.max_wait)
+    sequential = InferenceScheduler(model, 1, 0.0)
+    # the first pass loads kernels and allocates buffers, it is not measured
+    sequential.submit(audio).future.result()
+
+    print(f"{'streams':>8} {'mode':>11} {'utt/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for streams in args.streams:
+        for name, scheduler in (("sequential", sequential), ("batched", batched)):
+            throughput, latencies = run(scheduler, streams, args.utterances, audio)
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"{streams:>8} {name:>11} {throughput:8.2f} {statistics.median(latencies) * 1000:9.0f} "
+                  f"{p95 * 1000:9.0f}")
+
+    print()
+    metrics.report()
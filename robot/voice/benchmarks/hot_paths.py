@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+# Microbenchmarks of the assistant's hot paths on pinned synthetic inputs: the
+# capture loop helpers, command dispatch (dry run, against the bundled and a large
+# generated commands.json), intent matching, fuzzy matching and the conversation history.
+# Results are written as JSON; --compare flags cases slower than a baseline.
+#
+# usage (from robot/voice):
+#   python3 benchmarks/hot_paths.py --output baseline.json
+#   python3 benchmarks/hot_paths.py --compare baseline.json --threshold 0.1
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import capture  # noqa: E402
+import config_manager  # noqa: E402
+from conversation_store import ConversationStore  # noqa: E402
+from utils import trim  # noqa: E402
+
+SEED = 1234
+RATE = 48000
+CHUNK = 1024
+LARGE_COMMANDS = 5000
+HISTORY_SIZES = (100, 1000, 10000)
+
+UTTERANCES = [
+    "next track",  # exact command
+    "paws music",  # misspelled command
+    "open firefox",  # application launcher
+    "search for the weather in lisbon",  # search with a slot
+    "what is the capital of portugal",  # falls back to the AI
+]
+
+
+def pinned_chunk(rng, loud):
+    samples = rng.normal(0, 4000 if loud else 300, CHUNK).clip(-32768, 32767).astype(np.int16)
+    return samples.tobytes()
+
+
+class FakeStream:
+    """Replays pinned chunks as a PyAudio input stream."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.position = 0
+
+    def read(self, chunk, exception_on_overflow=True):
+        data = self.chunks[self.position % len(self.chunks)]
+        self.position += 1
+        return data
+
+
+def bench(number, repeat=5):
+    """Makes a case of a function, called @number times per measurement, @repeat measurements"""
+    def decorator(function):
+        def case():
+            function()
+        case.number = number
+        case.repeat = repeat
+        return case
+    return decorator
+
+
+def measure(function):
+    """@returns: seconds per call of every measurement"""
+    function()  # warm-up
+    runs = []
+    for _ in range(function.repeat):
+        started = time.perf_counter()
+        for _ in range(function.number):
+            function()
+        runs.append((time.perf_counter() - started) / function.number)
+    return runs
+
+
+def capture_cases(rng):
+    chunk = array('h', pinned_chunk(rng, True))
+    # a second of silence between two words, as detect_silence sees the recording
+    recording = array('h', b''.join(pinned_chunk(rng, loud) for loud in [True] * 20 + [False] * 47 + [True] * 20))
+    # 1.5 seconds of speech, then the background noise that ends the command
+    chunks = [pinned_chunk(rng, True) for _ in range(70)] + [pinned_chunk(rng, False) for _ in range(150)]
+
+    def record():
+        capture.record_until_silence(FakeStream(chunks), CHUNK, capture.FORMAT, 1, RATE, 3000, 0.8)
+
+    return {
+        'utils.trim': bench(2000)(lambda: trim(chunk)),
+        'capture.detect_silence': bench(20)(lambda: capture.detect_silence(recording, 3000, 0.8, RATE, CHUNK)),
+        'capture.record_until_silence': bench(20)(record),
+    }
+
+
+def large_commands(rng, count):
+    words = ["open", "close", "start", "stop", "show", "hide", "toggle", "launch", "mute", "screen", "volume",
+             "browser", "terminal", "music", "window", "light", "display", "mail", "calendar", "notes"]
+    commands = dict()
+    while len(commands) < count:
+        phrase = " ".join(rng.choice(words) for _ in range(rng.randint(2, 5)))
+        commands[phrase] = {"exec": f"echo {phrase.replace(' ', '-')}", "feedback": "", "blocking": False}
+    return commands
+
+
+def dispatch_cases(rng):
+    import ai_functions
+    import command_manager
+    import intent_index
+
+    with open('commands.json') as file:
+        bundled = json.load(file)
+    cases = dict()
+    sets = (('bundled', bundled, 20), (str(LARGE_COMMANDS), large_commands(rng, LARGE_COMMANDS), 2))
+    for name, commands, number in sets:
+        def dispatch(commands=commands, choices=list(commands)):
+            # the same choices list every call, so the intent index is only built once
+            command_manager.commands = commands
+            command_manager.choices = choices
+            for text in UTTERANCES:
+                command_manager.launch_if_any(text, dry_run=True)
+        cases[f'command_manager.launch_if_any[{name}]'] = bench(number)(dispatch)
+
+        index = intent_index.build(commands, dict())
+        cases[f'intent_index.match[{name}]'] = bench(number * 10)(
+            lambda index=index: [index.match(text) for text in UTTERANCES])
+
+    toggle_commands = ["toggle response style", "switch response style", "change response style"]
+    cases['ai_functions.is_fuzzy_command_match'] = bench(2000)(
+        lambda: [ai_functions.is_fuzzy_command_match(text, toggle_commands) for text in UTTERANCES])
+    return cases
+
+
+def open_app_cases(rng):
+    import open_app
+
+    # a typical /usr/bin listing
+    apps = [f"/usr/bin/{''.join(rng.choice('abcdefghijklmnopqrstuvwxyz-') for _ in range(rng.randint(3, 14)))}"
+            for _ in range(3000)]
+    return {'open_app.find_best_match': bench(5)(lambda: open_app.find_best_match('fire fox', apps))}
+
+
+def history_cases(rng, directory):
+    cases = dict()
+    for size in HISTORY_SIZES:
+        filename = os.path.join(directory, f'history-{size}.jsonl')
+        with open(filename, 'w', encoding='utf-8') as file:
+            for index in range(size):
+                message = {"role": "user" if index % 2 == 0 else "assistant",
+                           "content": " ".join(rng.choice(UTTERANCES) for _ in range(3))}
+                file.write(json.dumps({"op": "add", "message": message}) + "\n")
+        store = ConversationStore(filename, legacy_filename=None)
+
+        def load(filename=filename):
+            ConversationStore(filename, legacy_filename=None).get_history()
+
+        cases[f'history.load[{size}]'] = bench(max(1, 2000 // size))(load)
+        cases[f'history.append[{size}]'] = bench(20)(
+            lambda store=store: store.append({"role": "user", "content": "what time is it"}))
+        cases[f'history.compact[{size}]'] = bench(max(1, 1000 // size))(store.compact)
+    return cases
+
+
+def run(only):
+    config_manager.config = config_manager.Config({'logs': False, 'rate': RATE, 'channels': 1})
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        groups = [('capture', lambda: capture_cases(np.random.default_rng(SEED))),
+                  ('dispatch', lambda: dispatch_cases(random.Random(SEED))),
+                  ('open_app', lambda: open_app_cases(random.Random(SEED))),
+                  ('history', lambda: history_cases(random.Random(SEED), directory))]
+        for group, cases in groups:
+            if only and group not in only:
+                continue
+            try:
+                cases = cases()
+            except ImportError as e:
+                print(f"skipping {group}: {e}", file=sys.stderr)
+                continue
+            for name, function in cases.items():
+                runs = measure(function)
+                results[name] = {"median": statistics.median(runs), "min": min(runs), "runs": len(runs),
+                                 "calls": function.number}
+                print(f"{name:<45} median {results[name]['median'] * 1e6:12.1f} µs   "
+                      f"min {results[name]['min'] * 1e6:12.1f} µs")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the fastest measurement of each case, the least disturbed by the rest of the system.
+    @returns: the names of the cases more than @threshold slower than in the baseline
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        change = result["min"] / baseline[name]["min"] - 1
+        flag = "REGRESSION" if change > threshold else ""
+        print(f"{name:<45} {change * 100:+7.1f}%  {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hot path microbenchmarks")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--compare", default=None, help="baseline JSON file written by --output")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown flagged as a regression (0.1 = 10%%)")
+    parser.add_argument("--only", nargs="+", choices=["capture", "dispatch", "open_app", "history"])
+    args = parser.parse_args()
+
+    results = run(args.only)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "seed": SEED, "results": results}, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold * 100:.0f}%")
+            sys.exit(1)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Measures time to first token and time to first audio of streamed AI answers.
+# By default it runs against the bundled mock server, so no network or API key
+# is needed; pass --backend mistral to measure the real service.
+#
+# usage (from robot/voice): python3 benchmarks/llm_latency.py --requests 20
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_client import LLMClient, create_backend  # noqa: E402
+from mock_llm_server import start_server  # noqa: E402
+from speech_pipeline import SentenceSplitter  # noqa: E402
+
+PROMPT = [{"role": "system", "content": "You are a helpful assistant."},
+          {"role": "user", "content": "Tell me something about the moon."}]
+
+
+def measure(client, synthesize, max_tokens):
+    """@returns: (time to first token, time to first audio, time to whole-response audio)"""
+    start = time.perf_counter()
+    request = client.stream({"messages": PROMPT, "max_tokens": max_tokens})
+    splitter = SentenceSplitter()
+    first_token = first_sentence = None
+    full_response = ""
+    for token in request:
+        now = time.perf_counter()
+        if first_token is None:
+            first_token = now - start
+        full_response += token
+        sentences = splitter.feed(token)
+        if sentences and first_sentence is None:
+            first_sentence = (now - start, sentences[0])
+    end = time.perf_counter() - start
+    if first_sentence is None:
+        first_sentence = (end, splitter.flush())
+
+    # time to first audio: the first sentence is synthesized as soon as it is complete,
+    # compared with synthesizing the whole answer after the stream has ended
+    first_audio = first_sentence[0] + synthesize(first_sentence[1])
+    whole_audio = end + synthesize(full_response)
+    return first_token, first_audio, whole_audio
+
+
+def describe(name, values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    print(f"{name:<28} median {statistics.median(values) * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI streaming latency benchmark")
+    parser.add_argument("--backend", default="mock", choices=["mock", "mistral"])
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="mock server only")
+    parser.add_argument("--token-latency", type=float, default=0.03, help="mock server only")
+    parser.add_argument("--tts", action="store_true", help="include gTTS synthesis in time to first audio")
+    args = parser.parse_args()
+
+    if args.backend == "mock":
+        server = start_server(args.port, first_token_latency=args.first_token_latency,
+                              token_latency=args.token_latency)
+        backend = create_backend("mock", mock_url=f"http://127.0.0.1:{args.port}/v1/chat/completions")
+    else:
+        backend = create_backend("mistral", os.getenv("MISTRAL_API_KEY"))
+
+    if args.tts:
+        import voice_feedback
+
+        def synthesize(text):
+            started = time.perf_counter()
+            voice_feedback.synthesize(text)
+            return time.perf_counter() - started
+    else:
+        def synthesize(text):
+            return 0.0
+
+    client = LLMClient(backend)
+    results = [measure(client, synthesize, args.max_tokens) for _ in range(args.requests)]
+
+    print(f"backend: {backend.name}, requests: {args.requests}, tts: {args.tts}")
+    describe("time to first token", [r[0] for r in results])
+    describe("time to first audio", [r[1] for r in results])
+    describe("whole-response audio", [r[2] for r in results])
@@ -0,0 +1,219 @@
+import threading
+
+import numpy as np
+import pyaudio
+from termcolor import cprint
+
+import config_manager
+import metrics
+from frame_buffer import FrameBuffer
+from sampling_profiler import profiled
+
+# Shared microphone front-end, used by the assistant and the master mode setup
+
+FORMAT = pyaudio.paInt16
+SAMPLE_WIDTH = 2  # bytes per sample of FORMAT
+SOUND_LEVEL = 500  # quieter chunks are skipped by the silence detection, as utils.trim did
+
+BUFFER_SECONDS = 10  # initial capacity of the segment buffers, they grow for longer segments
+HOT_WORD_SECONDS = 1.2  # length of the hot word segments
+RING_SECONDS = 30  # audio kept by the continuous capture for a reader falling behind
+
+# segment buffer of each recording thread, reused from one segment to the next
+_buffers = threading.local()
+
+
+def log(text, color=None, attrs=None):
+    if attrs is None:
+        attrs = []
+    if color is None:
+        print(text)
+    elif config_manager.config['logs']:
+        cprint(text, color, attrs=attrs)
+
+
+# opens the microphone with the capture settings from config.json
+def open_stream(pyAudio, config):
+    return pyAudio.open(format=FORMAT,
+                        channels=config['channels'],
+                        rate=config['rate'],
+                        input=True,
+                        frames_per_buffer=config['chunk-size'])
+
+
+class ContinuousStream:
+    """
+    Keeps reading the microphone on a background thread into a ring buffer,
+    so nothing said while the assistant transcribes or acknowledges the hot
+    word is lost. read() has the PyAudio stream signature and returns the
+    audio in order from a read cursor, blocking until it has been recorded;
+    the cursor can be moved back (rewind) to start a segment with audio
+    that was already read, or forward to the live position (skip_to_live).
+    A reader more than RING_SECONDS behind loses the oldest audio.
+    The audio recorded while @speaking() is true (the assistant's voice may be
+    in it) is still kept, so the user can talk over the assistant, and is
+    reported by during_speech().
+    """
+
+    def __init__(self, stream, chunk, channels, rate, seconds=RING_SECONDS, speaking=None):
+        self.stream = stream
+        self.chunk = chunk
+        self.channels = channels
+        self.rate = rate
+        self.speaking = speaking
+        self._speech = []  # [start, end) sample spans recorded while speaking, oldest first
+        self._ring = np.zeros(int(seconds * rate) * channels, dtype=np.int16)
+        self._written = 0  # samples recorded since start, the ring holds the last len(_ring)
+        self._cursor = 0  # samples read
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._record, name='continuous-capture', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def _record(self):
+        size = len(self._ring)
+        while self._running:
+            data = self.stream.read(self.chunk, exception_on_overflow=False)
+            speaking = self.speaking is not None and self.speaking()
+            samples = np.frombuffer(data, dtype=np.int16)
+            with self._condition:
+                if speaking:
+                    if self._speech and self._speech[-1][1] == self._written:
+                        self._speech[-1][1] += len(samples)
+                    else:
+                        self._speech.append([self._written, self._written + len(samples)])
+                start = self._written % size
+                first = min(len(samples), size - start)
+                self._ring[start:start + first] = samples[:first]
+                self._ring[:len(samples) - first] = samples[first:]
+                self._written += len(samples)
+                while self._speech and self._speech[0][1] <= self._written - size:
+                    self._speech.pop(0)
+                self._condition.notify_all()
+
+    def read(self, chunk, exception_on_overflow=False):
+        """@returns: the next @chunk frames after the cursor as 16 bit PCM bytes"""
+        count = chunk * self.channels
+        size = len(self._ring)
+        with self._condition:
+            self._condition.wait_for(lambda: self._written - self._cursor >= count)
+            if self._written - self._cursor > size:
+                metrics.increment('capture.overruns')
+                self._cursor = self._written - size
+            start = self._cursor % size
+            first = min(count, size - start)
+            data = self._ring[start:start + first].tobytes() + self._ring[:count - first].tobytes()
+            self._cursor += count
+        return data
+
+    def rewind(self, seconds):
+        """Moves the cursor @seconds back, as far as the ring still holds."""
+        with self._condition:
+            oldest = max(0, self._written - len(self._ring))
+            self._cursor = max(oldest, self._cursor - int(seconds * self.rate) * self.channels)
+
+    def during_speech(self, samples):
+        """@returns: True if any of the last @samples samples read were recorded while speaking"""
+        with self._condition:
+            start = self._cursor - samples
+            return any(begin < self._cursor and end > start for begin, end in self._speech)
+
+    def skip_to_live(self):
+        """Drops the audio recorded but not read yet."""
+        with self._condition:
+            self._cursor = self._written
+
+
+def detect_silence(audio_data, threshold, silence_duration, rate, chunk):
+    """
+    Detects silence in the audio.
+    :param audio_data: Audio data (array of amplitudes).
+    :param threshold: Amplitude threshold to consider silence.
+    :param silence_duration: Minimum duration of silence (in seconds).
+    :param rate: Audio sample rate.
+    :param chunk: Audio chunk size.
+    :return: True if silence is detected, False otherwise.
+    """
+    silent_chunks = 0
+    required_silent_chunks = int(silence_duration * rate / chunk)
+
+    for amplitude in audio_data:
+        if abs(amplitude) < threshold:
+            silent_chunks += 1
+            if silent_chunks >= required_silent_chunks:
+                return True
+        else:
+            silent_chunks = 0
+
+    return False
+
+
+def get_buffer():
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None:
+        config = config_manager.config
+        buffer = _buffers.buffer = FrameBuffer(config['rate'] * config['channels'] * BUFFER_SECONDS)
+    return buffer
+
+
+@profiled('capture')
+def record_until_silence(stream, chunk, format, channels, rate, threshold, silence_duration, is_hotword=False,
+                         buffer=None, extend=False):
+    """
+    Records audio until silence is detected and at least 3 seconds of audio are recorded.
+    Durations are counted in recorded audio, so a ContinuousStream behind the microphone
+    is read at once instead of waiting again.
+    :param buffer: FrameBuffer to record into, this thread's own by default.
+    :param extend: For a hot word, speech going on past its segment is recorded until the silence,
+                   so the hot word and the command said in one breath are a single segment.
+    :return: The segment as 16 bit PCM, a memoryview into the buffer, valid until its next recording.
+    """
+    buffer = buffer or get_buffer()
+    buffer.clear()
+    allocations, bytes_copied = buffer.allocations, buffer.bytes_copied
+    silent_chunks = 0
+    required_silent_chunks = int(silence_duration * rate / chunk)
+    samples_per_second = rate * channels
+    extending = False
+
+    log("Waiting command..." if not is_hotword else "Waiting hot word...", "blue" if not is_hotword else "yellow", attrs=["bold"])
+
+    while True:
+        audio_data = buffer.append(stream.read(chunk, exception_on_overflow=False))
+
+        # Chunks without any sound above the noise level are skipped
+        if len(audio_data) == 0 or (audio_data.max() <= SOUND_LEVEL and audio_data.min() >= -SOUND_LEVEL):
+            continue
+
+        # Checks if the audio is below the silence threshold
+        if audio_data.max() < threshold:
+            silent_chunks += 1
+        else:
+            silent_chunks = 0
+
+        # If it's a hot-word, sends the audio every x seconds
+        if is_hotword and buffer.length >= HOT_WORD_SECONDS * samples_per_second:
+            if not extend:
+                break
+            if not extending and silent_chunks > 0 or silent_chunks >= required_silent_chunks:
+                break
+            extending = True
+
+        # Checks if silence is detected and if at least 3 seconds have passed
+        if not is_hotword and silent_chunks >= required_silent_chunks and buffer.length >= 3.0 * samples_per_second:
+            break
+
+    metrics.increment('capture.segments')
+    metrics.increment('capture.buffer_allocations', buffer.allocations - allocations)
+    metrics.increment('capture.bytes_copied', buffer.bytes_copied - bytes_copied)
+    return buffer.pcm()
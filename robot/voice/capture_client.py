@@ -0,0 +1,89 @@
+import socket
+import subprocess
+
+import click
+import pyaudio
+from termcolor import cprint
+
+import capture
+import config_manager
+from daemon_protocol import COMMAND_STAGE, DEFAULT_SOCKET, HOT_WORD_STAGE, recv_message, send_message
+
+# Microphone and speaker of one room, served by assistant_daemon.py: records the
+# segments the daemon asks for and plays the speech it sends back with mpv.
+#
+# usage (from robot/voice):
+#   python3 capture_client.py --room kitchen
+
+SILENCE_DURATION = 0.8  # Minimum duration of silence to stop recording (in seconds)
+
+
+# plays one clip, mpv reads it from stdin
+def play(audio):
+    try:
+        subprocess.run(['mpv', '--really-quiet', '--no-video', '-'], input=audio, check=False)
+    except FileNotFoundError:
+        cprint("voice feedback requires mpv media player installed on your distro!", "red")
+
+
+# receives the speech and the result of the segment just sent
+# @returns: the result header, None if the daemon reported an error
+def receive_result(sock):
+    while True:
+        header, payload = recv_message(sock)
+        if header['type'] == 'audio':
+            play(payload)
+        elif header['type'] == 'result':
+            return header
+        elif header['type'] == 'error':
+            cprint(f"daemon error: {header['message']}", "red", attrs=['bold'])
+            return None
+
+
+@click.command()
+@click.option("--room", default="default", help="Name of the room, each room keeps its own session")
+@click.option("--socket", "socket_path", default=None, help="UNIX socket of the assistant daemon")
+def main(room, socket_path):
+    config_manager.init()
+    config = config_manager.config
+    socket_path = socket_path or config.get('daemon-socket', DEFAULT_SOCKET)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    send_message(sock, {'type': 'hello', 'room': room, 'rate': config['rate'], 'channels': config['channels']})
+    header, _ = recv_message(sock)
+    stage = header['stage']
+    cprint(f"🚀 Connected to the assistant daemon as {header['room']}", "blue")
+
+    pyAudio = pyaudio.PyAudio()
+    stream = capture.open_stream(pyAudio, config)
+    try:
+        while True:
+            pcm = capture.record_until_silence(stream, config['chunk-size'], capture.FORMAT, config['channels'],
+                                               config['rate'], config['speech-threshold'], SILENCE_DURATION,
+                                               is_hotword=stage == HOT_WORD_STAGE,
+                                               extend=config.get('wake-plus-command', False))
+            send_message(sock, {'type': 'segment', 'stage': stage}, pcm)
+            result = receive_result(sock)
+            if result is None:
+                return
+            if result['transcript'] and (stage == COMMAND_STAGE or result['hot_word']):
+                cprint(f"You: {result['transcript']}", "blue", attrs=["bold"])
+            for action in result['actions']:
+                cprint(f"  {action['type']}: " + ", ".join(f'{key}={value}' for key, value in action.items()
+                                                           if key != 'type'), "green")
+            if result['quit']:
+                return  # the daemon ended the session
+            stage = result['stage']
+    except (EOFError, OSError):
+        cprint('Lost the connection to the assistant daemon', 'red', attrs=['bold'])
+    except KeyboardInterrupt:
+        send_message(sock, {'type': 'bye'})
+    finally:
+        stream.close()
+        pyAudio.terminate()
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 import json
 import os.path
+import re
 import shlex
 import subprocess
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 
 from termcolor import cprint
 from thefuzz import fuzz
@@ -9,9 +14,12 @@ from thefuzz import process
 from dotenv import load_dotenv
 
 import config_manager
+import intent_index
 import master_mode_manager
-from voice_feedback import give_execution_feedback, speak, give_exiting_feedback
-from ai_functions import chat_with_mistral  # Import the function we created
+import metrics
+from sampling_profiler import profiled
+from voice_feedback import give_execution_feedback, speak, give_exiting_feedback, cancel_speech
+from ai_functions import chat_with_mistral, chat_in_background  # Import the function we created
 from notifier import notify
 from weather import get_weather
 
@@ -24,18 +32,68 @@ load_dotenv()
 quitCommand = "see you later"  # Say this to turn off your voice control engine
 activateMasterModeCommand = "activate master control mode"  # Say this to turn on master control mode
 deactivateMasterModeCommand = "deactivate master control mode"  # Say this to turn off master control mode
-
-# Internal variables
-self_activated_master_mode = False  # Used for notifying the user if master control mode was enabled implicitly
+stopSpeechCommands = ["stop", "stop talking", "be quiet"]  # Say this to silence the voice feedback
+toggleStyleCommands = ["toggle response style", "switch response style", "change response style"]
+spotifyCommands = {"stop music": "pause", "next track": "next", "previous track": "previous"}
+weatherCommand = "climate conditions"  # Say this to hear the weather conditions
+confirmAnswers = {"yes": True, "yeah": True, "yep": True, "sure": True, "do it": True, "yes please": True,
+                  "no": False, "nope": False, "cancel": False, "no thanks": False}  # Replies to "Did you mean ...?"
+
+# What launch_if_any does with an utterance, see decide()
+# route: "built-in", "exec", "open", "close", "spotify", "weather", "ai", "confirm" (ask before running
+#        the command) or None (nothing to do)
+# command: the matched phrase (a commands.json key for fuzzy matches), None when sent to the AI
+# score: similarity of the match from 0 to 100, 100 for the fixed phrases
+# slots: values taken from the utterance (app, song, search_term, prompt), the command line to "exec"
+#        and the "phrase" the intent index matched
+Decision = namedtuple('Decision', ['route', 'command', 'score', 'slots'])
+
+# Fixed phrases spoken by the built-in actions, pre-synthesized at startup
+built_in_speeches = [
+    "Paused Spotify",
+    "Skipping to next track",
+    "Going back to previous track",
+    "Sorry, I couldn't open the application.",
+    "Sorry, I encountered an error when trying to get a response.",
+    "Deactivating Master Control Mode of this session",
+    "Master Control Mode is already Activated",
+    "You need to configure master control mode before using it, refer to the project's readme",
+    "Activated Master Control Mode",
+    "Master Control Mode is already Off",
+    "Deactivated Master Control Mode",
+    "Okay",
+]
+
+# Internal variables, a daemon session keeps its own (see session_state)
+# self_activated_master_mode: used for notifying the user if master control mode was enabled implicitly
+def new_state():
+    return {"self_activated_master_mode": False}
+
+
+_state = new_state()
 
 # Stores all the keys in commands dictionary to be extracted by Fuzzy Matcher
 choices = []
 
+# Actions taken for the assistant daemon session served by the current thread
+_action_capture = threading.local()
+
+# Internal variables of the assistant daemon session served by the current thread
+_session = threading.local()
+
+# The command waiting for a yes or no on the current thread (the listening loop or a daemon session)
+_confirmation = threading.local()
+CONFIRMATION_TIMEOUT = 20  # seconds the question stays open
+
+# Paraphrase matcher of the current choices, rebuilt when they change
+_intent_index = None
+_intent_index_choices = None
 
-# Initializing commands with commands specified in commands.json
-def init():
+
+# Initializing commands with commands specified in commands.json (or @filename)
+def init(filename="commands.json"):
     global commands, choices
-    commands = get_commands_from_file()
+    commands = get_commands_from_file(filename)
     name = config_manager.config['name']
 
     commands[f'see you later {name}'] = "<built-in>"
@@ -51,9 +109,29 @@ def get_weather_conditions():
     weather_info = get_weather(api_key)
     return weather_info
 
+# Phrases that never change: built-in speeches and command feedbacks without placeholders
+def get_static_speeches():
+    speeches = list(built_in_speeches)
+    if config_manager.config['master-mode-barrier-speech-enabled']:
+        speeches.append(config_manager.config['master-mode-barrier-speech'])
+    for command in commands.values():
+        if isinstance(command, dict) and command.get('feedback'):
+            feedback = command['feedback']
+            if '{' not in feedback and '*' not in feedback:
+                speeches.append(feedback)
+    return speeches
+
+# @returns: the intent index of the current choices and paraphrases.json
+def get_intent_index():
+    global _intent_index, _intent_index_choices
+    if _intent_index is None or _intent_index_choices is not choices:
+        _intent_index = intent_index.build(choices, intent_index.load_paraphrases())
+        _intent_index_choices = choices
+    return _intent_index
+
 # Getting JSON data from file
-def get_commands_from_file():
-    return json.load(open(os.path.join(os.getcwd(), "commands.json")))
+def get_commands_from_file(filename="commands.json"):
+    return json.load(open(os.path.join(os.getcwd(), filename)))
 
 
 from spotify_control import play_song, pause_song, next_song, previous_song
@@ -71,48 +149,254 @@ def log(text, color=None, attrs=None):
         cprint(text, color, attrs=attrs)
 
 
-def launch_if_any(text):
+# Collects the actions launch_if_any takes on this thread, as dicts with their "type"
+@contextmanager
+def capture_actions():
+    previous = getattr(_action_capture, 'actions', None)
+    actions = []
+    _action_capture.actions = actions
+    try:
+        yield actions
+    finally:
+        _action_capture.actions = previous
+
+
+# Uses the @state dict of an assistant daemon session as this thread's internal variables,
+# it starts out empty and keeps them from one segment to the next
+@contextmanager
+def session_state(state):
+    previous = getattr(_session, 'state', None)
+    for key, value in new_state().items():
+        state.setdefault(key, value)
+    _session.state = state
+    try:
+        yield state
+    finally:
+        _session.state = previous
+
+
+def _get_state():
+    state = getattr(_session, 'state', None)
+    return state if state is not None else _state
+
+
+# @returns: the action, recorded when the thread is capturing them
+def record_action(kind, **details):
+    action = dict(type=kind, **details)
+    actions = getattr(_action_capture, 'actions', None)
+    if actions is not None:
+        actions.append(action)
+    return action
+
+
+def decide(text):
     """
-    Checks if the text matches a known command. Otherwise, sends it to the AI.
+    Decides what launch_if_any does with the text, without doing any of it.
+    :return: The Decision.
     """
-    
-    # Check if the command is to toggle AI response style
-    if text.lower() in ["toggle response style", "switch response style", "change response style"]:
-        log("Toggling AI response style...", "yellow")
-        response = chat_with_mistral(text)  # This will handle the toggle internally
-        return
-        
-    # Check if the command is to search the internet
-    if text.lower().startswith("search for"):
-        search_term = text[len("search for"):].strip()
-        print(f"'{search_term}'")  # Debug
+    lowered = text.lower()
 
+    # Silences everything queued or playing, the AI request was already cancelled
+    if lowered in stopSpeechCommands:
+        return Decision("built-in", "stop", 100, {})
+
+    # Toggling the AI response style is handled by the AI functions
+    if lowered in toggleStyleCommands:
+        return Decision("ai", lowered, 100, {"prompt": text})
+
+    # Searching the internet
+    if lowered.startswith("search for"):
+        search_term = text[len("search for"):].strip()
         if search_term:
             if "search for *" in commands:
-                command_template = commands["search for *"]["exec"]
-                feedback_template = commands["search for *"]["feedback"]
-
                 # Format the command with the search term
-                command = command_template.format(search_term)
-                feedback = feedback_template.format(search_term)
+                command = commands["search for *"]["exec"].format(search_term)
+                feedback = commands["search for *"]["feedback"].format(search_term)
 
                 # Split the command into parts, but keep the search term as a single argument
                 command_base = command.split(maxsplit=2)  # Split only the base command (python3 /path/to/script.py)
                 final_command = command_base + [search_term]  # Add the search term as a single argument
-
-                # Execute the command
-                subprocess.Popen(final_command)
-                speak(feedback)
             else:
-                command = ["/usr/bin/python3", "/home/fantucci/robot/voice/search_for.py", search_term]
-                print(f"Executing default command: {' '.join(command)}")  # Debug
-                subprocess.Popen(command)
-                speak(f"Searching the internet for {search_term}")
-            return
-
-    # Check if the command is to open an application
-    if text.lower().startswith("open"):
-        app_name = text[len("open"):].strip()
+                final_command = ["/usr/bin/python3", "/home/fantucci/robot/voice/search_for.py", search_term]
+                feedback = f"Searching the internet for {search_term}"
+            return Decision("exec", "search for *", 100,
+                            {"search_term": search_term, "exec": final_command, "feedback": feedback})
+
+    # Opening and closing applications
+    if lowered.startswith("open"):
+        return Decision("open", "open *", 100, {"app": text[len("open"):].strip()})
+    if lowered.startswith("close"):
+        return Decision("close", "close *", 100, {"app": text[len("close"):].strip()})
+
+    # Spotify
+    if lowered.startswith("play"):
+        song_name = text[len("play"):].strip()
+        if song_name:
+            return Decision("spotify", "play *", 100, {"operation": "play", "song": song_name})
+        return Decision(None, "play *", 100, {})
+    # Spotify and weather conditions
+    if lowered in spotifyCommands or lowered == weatherCommand:
+        return command_decision(lowered, 100)
+
+    # Answering "Did you mean ...?"
+    pending = getattr(_confirmation, 'pending', None)
+    if pending and lowered in confirmAnswers and time.monotonic() < pending['expires']:
+        if confirmAnswers[lowered]:
+            return command_decision(pending['command'], pending['score'], {"phrase": pending['phrase']})
+        return Decision("built-in", "cancel", 100, {})
+
+    # Check if the text matches any known command
+    probability = process.extractOne(text, choices)
+    if probability and is_text_prediction_applicable(text, probability[0]):
+        return command_decision(probability[0], probability[1])
+
+    # Then for misheard or reworded commands, asking first when unsure or when the command
+    # is not to be run on a guess
+    match = get_intent_index().match(text)
+    if match:
+        execute_threshold = config_manager.config.get('intent-execute-threshold', 0.8)
+        confirm_threshold = config_manager.config.get('intent-confirm-threshold', 0.55)
+        score = round(match.score * 100)
+        if match.score >= execute_threshold and not needs_confirmation(match.command):
+            return command_decision(match.command, score, {"phrase": match.phrase})
+        if match.score >= confirm_threshold:
+            return Decision("confirm", match.command, score, {"phrase": match.phrase, "prompt": text})
+
+    # If it's not a known command, it is sent to the AI
+    return Decision("ai", None, probability[1] if probability else 0, {"prompt": text})
+
+
+# @returns: the stop phrase the transcript ends with, None if there is none
+def stop_phrase(text):
+    words = re.sub(r'[^a-z ]+', '', text.lower()).split()
+    for phrase in stopSpeechCommands:
+        if words[-len(phrase.split()):] == phrase.split():
+            return phrase
+    return None
+
+
+# Built-in actions and commands marked "confirm" in commands.json only run on a close match
+# of the intent index once the user said yes
+def needs_confirmation(key):
+    entry = commands.get(key)
+    return entry == "<built-in>" or isinstance(entry, dict) and entry.get("confirm", False)
+
+
+# The Decision running the commands.json (or built-in) @key, the phrases handled in-process take
+# the same route whether they were said exactly or matched
+def command_decision(key, score, slots=None):
+    slots = dict(slots or {})
+    lowered = key.lower()
+    if lowered in spotifyCommands:
+        return Decision("spotify", key, score, dict(slots, operation=spotifyCommands[lowered]))
+    if lowered == weatherCommand:
+        return Decision("weather", key, score, slots)
+    try:
+        command = commands[key]['exec']
+    except TypeError:
+        command = commands[key]
+    if command == "<built-in>":
+        return Decision("built-in", key, score, slots)
+    if not command:
+        return Decision(None, key, score, slots)
+    slots["exec"] = command
+    return Decision("exec", key, score, slots)
+
+
+# The action a decision takes, as recorded by record_action
+def decision_action(decision):
+    slots = decision.slots
+    if decision.route == "built-in":
+        return dict(type="built-in", name=decision.command)
+    if decision.route == "ai":
+        return dict(type="ai", prompt=slots["prompt"])
+    if decision.route == "exec":
+        return dict(type="exec", command=slots["exec"])
+    if decision.route == "spotify":
+        return dict(type="spotify", **{key: slots[key] for key in ("operation", "song") if key in slots})
+    if decision.route in ("open", "close"):
+        return dict(type=decision.route, app=slots["app"])
+    if decision.route == "weather":
+        return dict(type="weather")
+    if decision.route == "confirm":
+        return dict(type="confirm", command=decision.command)
+    return None
+
+
+@profiled('dispatch')
+def launch_if_any(text, dry_run=False):
+    """
+    Checks if the text matches a known command. Otherwise, sends it to the AI.
+    With @dry_run the command is only matched: nothing is executed, spoken or sent.
+    :return: The action as a dict with its "type" (see record_action), None if there is nothing to do.
+    """
+    decision = decide(text)
+    if dry_run:
+        action = decision_action(decision)
+        return record_action(action.pop("type"), **action) if action else None
+    return execute(decision)
+
+
+def execute(decision):
+    """
+    Takes the action decided by decide().
+    :return: The action as a dict with its "type" (see record_action), None if there was nothing to do.
+    """
+    route = decision.route
+    slots = decision.slots
+
+    # Whatever follows the question answers it or moves on
+    _confirmation.pending = None
+    if "phrase" in slots and route != "confirm":
+        metrics.increment("intent.llm_fallbacks_avoided")
+
+    if route == "confirm":
+        log(f"Asking to confirm: {decision.command}", "yellow")
+        metrics.increment("intent.confirmations")
+        _confirmation.pending = {"command": decision.command, "score": decision.score, "phrase": slots["phrase"],
+                                 "expires": time.monotonic() + CONFIRMATION_TIMEOUT}
+        action = record_action("confirm", command=decision.command)
+        speak(f"Did you mean {decision.command}?")
+        return action
+
+    if route == "built-in" and decision.command == "cancel":
+        metrics.increment("intent.declined")
+        action = record_action("built-in", name="cancel")
+        speak("Okay")
+        return action
+
+    if route == "built-in" and decision.command == "stop":
+        log("Stopping voice feedback...", "yellow")
+        cancel_speech()
+        return record_action("built-in", name="stop")
+
+    if route == "built-in":
+        action = record_action("built-in", name=decision.command)
+        check_for_built_in_actions(decision.command)
+        return action
+
+    if route == "ai" and decision.command in toggleStyleCommands:
+        log("Toggling AI response style...", "yellow")
+        action = record_action("ai", prompt=slots["prompt"])
+        response = chat_with_mistral(slots["prompt"])  # This will handle the toggle internally
+        return action
+
+    if route == "ai":
+        # Sent to the AI without blocking the listening loop
+        log("Sending to AI...", "yellow")
+        action = record_action("ai", prompt=slots["prompt"])
+        chat_in_background(slots["prompt"])
+        return action
+
+    if route == "exec" and "search_term" in slots:
+        log(f"Searching for '{slots['search_term']}': {' '.join(slots['exec'])}", "yellow")
+        subprocess.Popen(slots["exec"])
+        action = record_action("exec", command=slots["exec"])
+        speak(slots["feedback"])
+        return action
+
+    if route == "open":
+        app_name = slots["app"]
         log(f"Trying to open application: {app_name}", "yellow")
     
         # Call the script to open the application using the virtual environment Python
@@ -122,6 +406,7 @@ def launch_if_any(text):
             stderr=subprocess.PIPE,
             text=True  # Decode stdout/stderr as text
         )
+        action = record_action("open", app=app_name, returncode=result.returncode)
     
         # Log the output and errors
         if result.stdout:
@@ -136,14 +421,13 @@ def launch_if_any(text):
         else:
             log(f"Application '{app_name}' opened successfully.", "green")
             speak(f"Opened {app_name}")
-        return
-        
+        return action
 
-    # Check if the command is to close an application
-    if text.lower().startswith("close"):
-        app_name = text[len("close"):].strip()
+    if route == "close":
+        app_name = slots["app"]
         log(f"Trying to close application: {app_name}", "yellow")
         speak(f"Clossing {app_name}")
+        action = record_action("close", app=app_name)
         # Call the script to close the application
         subprocess.run(
             ["/home/fantucci/robot/.venv/bin/python3", "/home/fantucci/robot/voice/close_app.py", app_name],
@@ -151,56 +435,39 @@ def launch_if_any(text):
             stderr=subprocess.PIPE,
             text=True
         )
-        return  
-    
-    # Check if the command is for Spotify
-    if text.lower().startswith("play"):
-        song_name = text[len("play"):].strip()
-        if song_name:
-            if play_song(song_name):
-                speak(f"Playing {song_name} on Spotify")
+        return action
+
+    if route == "spotify":
+        operation = slots["operation"]
+        action = record_action("spotify", operation=operation, **({"song": slots["song"]} if "song" in slots else {}))
+        if operation == "play":
+            if play_song(slots["song"]):
+                speak(f"Playing {slots['song']} on Spotify")
             else:
-                speak(f"Could not find {song_name} on Spotify")
-        return
-    elif text.lower() == "stop music":
-        pause_song()
-        speak("Paused Spotify")
-        return
-    elif text.lower() == "next track":
-        next_song()
-        speak("Skipping to next track")
-        return
-    elif text.lower() == "previous track":
-        previous_song()
-        speak("Going back to previous track")
-        return
-
-    # Check if the command is to get weather conditions
-    if text.lower() == "climate conditions":
+                speak(f"Could not find {slots['song']} on Spotify")
+        elif operation == "pause":
+            pause_song()
+            speak("Paused Spotify")
+        elif operation == "next":
+            next_song()
+            speak("Skipping to next track")
+        elif operation == "previous":
+            previous_song()
+            speak("Going back to previous track")
+        return action
+
+    if route == "weather":
+        action = record_action("weather")
         # Get and speak weather conditions in English
         weather_info = get_weather(language="en")
         speak(weather_info)  # Speak the weather conditions
-        return
-    
-    # Check if the text matches any known command
-    probability = process.extractOne(text, choices)
-    print("probability:", probability)
+        return action
 
-    if probability and is_text_prediction_applicable(text, probability[0]):
-        try:
-            command = commands[probability[0]]['exec']
-        except TypeError:
-            command = commands[probability[0]]
-
-        if check_for_built_in_actions(probability[0]):
-            return
-
-        if not command:
-            cprint(f">>> Error: Command is empty for '{probability[0]}'", "red", attrs=["bold"])
-            return
-
-        if isinstance(commands[probability[0]], dict) and commands[probability[0]]['feedback']:
-            speak(commands[probability[0]]['feedback'], commands[probability[0]]['blocking'])
+    if route == "exec":
+        command = slots["exec"]
+        entry = commands.get(decision.command)
+        if isinstance(entry, dict) and entry['feedback']:
+            speak(entry['feedback'], entry['blocking'])
         else:
             give_execution_feedback()
 
@@ -211,14 +478,16 @@ def launch_if_any(text):
             args = shlex.split(command)
             if args:
                 subprocess.Popen(args, start_new_session=True)
+                return record_action("exec", command=command)
             else:
                 cprint(f">>> Error: Command split resulted in an empty list for '{command}'", "red", attrs=["bold"])
         except Exception as e:
             cprint(f">>> Error executing command: {e}", "red", attrs=["bold"])
-    else:
-        # If it's not a known command, send it to the AI
-        log("Sending to AI...", "yellow")
-        response = chat_with_mistral(text)  # Use the Mistral AI function
+        return None
+
+    if decision.command in commands:
+        cprint(f">>> Error: Command is empty for '{decision.command}'", "red", attrs=["bold"])
+    return None
 
 
 # Performs further fuzzy match to ensure the command to be executed is correct
@@ -234,10 +503,10 @@ def is_text_prediction_applicable(text, predicted_text):
 # Before diving further, we perform a check for in-built actions here
 # @returns: True if an implicit action is invoked
 def check_for_built_in_actions(text):
-    global self_activated_master_mode
+    state = _get_state()
     if text.startswith(quitCommand):
         give_execution_feedback()
-        if self_activated_master_mode:
+        if state["self_activated_master_mode"]:
             speak('Deactivating Master Control Mode of this session', wait=True)
         give_exiting_feedback()
         exit(0)
@@ -249,7 +518,7 @@ def check_for_built_in_actions(text):
             speak('You need to configure master control mode before using it, refer to the project\'s readme', wait=True)
             return True
         config_manager.config['master-mode'] = True
-        self_activated_master_mode = True
+        state["self_activated_master_mode"] = True
         cprint(f'MASTER CONTROL MODE: ON', "blue", attrs=['bold'])
         speak('Activated Master Control Mode', wait=True)
         return True
@@ -258,7 +527,7 @@ def check_for_built_in_actions(text):
             speak('Master Control Mode is already Off', wait=True)
             return True
         config_manager.config['master-mode'] = False
-        self_activated_master_mode = False
+        state["self_activated_master_mode"] = False
         cprint(f'MASTER CONTROL MODE: OFF', "blue", attrs=['bold'])
         speak('Deactivated Master Control Mode', wait=True)
         return True
@@ -1,15 +1,51 @@
 import json
 import os
+import threading
+from contextlib import contextmanager
+
+_overrides = threading.local()
+
+
+class Config(dict):
+    """
+    The configuration, which sessions of the assistant daemon can override
+    per thread: inside session_overrides(), reads see the session's values
+    first and writes only change the session.
+    """
+
+    def _session(self):
+        return getattr(_overrides, 'values', None)
+
+    def __getitem__(self, key):
+        session = self._session()
+        if session is not None and key in session:
+            return session[key]
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        session = self._session()
+        if session is not None:
+            session[key] = value
+        else:
+            dict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __contains__(self, key):
+        session = self._session()
+        return (session is not None and key in session) or dict.__contains__(self, key)
+
 
 # stores the configuration from the config.json
-config = dict()
+config = Config()
 live_config = dict()
 
 
 # initializing config with configuration specified in config.json
 def init():
     global config, live_config
-    config = get_config_from_file("config.json")
+    config = Config(get_config_from_file("config.json"))
     live_config = get_config_from_file("live_data.json")
     validate_config()
 
@@ -30,3 +66,14 @@ def validate_config():
         raise Exception("📢 config-error: record-duration must be greater than zero")
     if config['record-duration'] <= 0:
         raise Exception("📢 config-error: record-duration must be greater than zero")
+
+
+# applies the @values overrides (and the session's own writes) to this thread's view of the config
+@contextmanager
+def session_overrides(values):
+    previous = getattr(_overrides, 'values', None)
+    _overrides.values = values
+    try:
+        yield values
+    finally:
+        _overrides.values = previous
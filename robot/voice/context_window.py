@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import re
+
+# Cached summary of the turns that no longer fit in the context window
+SUMMARY_FILE = "conversation_summary.json"
+
+# Rough per-message overhead of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Budget kept free for the summary once older turns are folded
+SUMMARY_RESERVE_TOKENS = 160
+
+_token_pattern = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """
+    Approximates the number of model tokens in a text without a real tokenizer:
+    one token per punctuation mark and about one per four characters of a word.
+    """
+    tokens = 0
+    for piece in _token_pattern.findall(text):
+        tokens += max(1, (len(piece) + 3) // 4)
+    return tokens
+
+
+def estimate_message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def message_key(message):
+    """Identifies a message, so a summary is only reused for the conversation it was made of."""
+    return hashlib.sha1(f'{message["role"]}\n{message["content"]}'.encode("utf-8")).hexdigest()
+
+
+class ContextWindow:
+    """
+    Builds the message list sent to the model: the system message and the most
+    recent turns that fit in the token budget. Older turns are folded into a
+    summary which is cached on disk and only regenerated once enough new turns
+    have fallen out of the window.
+    """
+
+    def __init__(self, summarizer, summary_file=SUMMARY_FILE):
+        # summarizer(messages, previous_summary) -> summary text or None
+        self.summarizer = summarizer
+        self.summary_file = summary_file
+        self._summary = None
+        self._failed = None  # (first message key, message count) of the latest failed summarization
+
+    def _load_summary(self):
+        if self._summary is None:
+            self._summary = {"covered": 0, "first": None, "text": ""}
+            if os.path.exists(self.summary_file):
+                try:
+                    with open(self.summary_file, "r", encoding="utf-8") as file:
+                        self._summary = json.load(file)
+                except (OSError, ValueError):
+                    pass
+        return self._summary
+
+    def _save_summary(self, summary):
+        self._summary = summary
+        tmp_filename = self.summary_file + ".tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as file:
+                json.dump(summary, file, ensure_ascii=False)
+            os.replace(tmp_filename, self.summary_file)
+        except OSError as e:
+            print(f"Unable to save conversation summary: {e}")
+
+    def _get_summary(self, older, refresh_messages):
+        """Returns the summary of the @older messages, regenerating it only when stale."""
+        summary = self._load_summary()
+        covered = summary["covered"]
+        first = message_key(older[0])
+        # History was cleared or rewritten since the summary was made
+        if covered > len(older) or summary.get("first") != first:
+            summary = {"covered": 0, "first": first, "text": ""}
+            covered = 0
+        if len(older) - covered < refresh_messages and summary["text"]:
+            return summary["text"]
+        # A failed summarizer is only retried once more messages have to be summarized
+        if self._failed == (first, len(older)):
+            return summary["text"]
+
+        text = self.summarizer(older[covered:], summary["text"])
+        if text:
+            self._failed = None
+            self._save_summary({"covered": len(older), "first": first, "text": text})
+            return text
+        self._failed = (first, len(older))
+        return summary["text"]
+
+    def build(self, history, token_budget, refresh_messages):
+        """
+        Returns (messages, token_count) for the request.
+        @history must start with the system message.
+        """
+        system, turns = history[0], history[1:]
+        budget = token_budget - estimate_message_tokens(system)
+
+        start = self._fit(turns, budget)
+        if start > 0:
+            start = self._fit(turns, budget - SUMMARY_RESERVE_TOKENS)
+
+        older, recent = turns[:start], turns[start:]
+        if older:
+            summary = self._get_summary(older, refresh_messages)
+            if summary:
+                system = {"role": "system",
+                          "content": f"{system['content']}\n\nSummary of the earlier conversation: {summary}"}
+        messages = [system] + recent
+        return messages, sum(estimate_message_tokens(message) for message in messages)
+
+    @staticmethod
+    def _fit(turns, budget):
+        """Returns the index of the first turn kept so that the latest turns fit in @budget."""
+        used = 0
+        start = len(turns)
+        while start > 0:
+            cost = estimate_message_tokens(turns[start - 1])
+            # The newest message is always sent, even if it alone exceeds the budget
+            if used + cost > budget and start < len(turns):
+                break
+            used += cost
+            start -= 1
+
+        # The window should begin with a user message, not half a turn
+        while start < len(turns) - 1 and turns[start]["role"] != "user":
+            start += 1
+        return start
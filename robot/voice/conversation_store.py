@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+
+# Append-only log of the AI conversation, one JSON record per line
+HISTORY_LOG_FILE = "conversation_history.jsonl"
+# History file used before the append-only log, migrated on first load
+LEGACY_HISTORY_FILE = "conversation_history.json"
+
+# The log is rewritten once it holds this many records more than the live history
+COMPACT_SLACK = 50
+
+
+class ConversationStore:
+    """
+    Keeps the conversation history in memory and persists every change
+    as one appended line instead of rewriting the whole file per turn.
+
+    Records are either {"op": "add", "message": {...}} or
+    {"op": "system", "content": "..."} (replaces the system message).
+    A torn last line left by a crash is skipped on load and dropped
+    by the next compaction.
+    """
+
+    def __init__(self, filename=HISTORY_LOG_FILE, legacy_filename=LEGACY_HISTORY_FILE):
+        self.filename = filename
+        self.legacy_filename = legacy_filename
+        self.messages = []
+        self._records = 0
+        # The log is read lazily on first use, so a plain truncate never parses it
+        self._file_state = False
+        self._lock = threading.RLock()
+
+    # identifies the log on disk, so changes made by other processes
+    # (e.g. clean_history.py) are picked up before the next use
+    def _stat(self):
+        try:
+            st = os.stat(self.filename)
+            return st.st_ino, st.st_size, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        self.messages = []
+        self._records = 0
+        torn = False
+        if os.path.exists(self.filename):
+            with open(self.filename, "r", encoding="utf-8") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        torn = True
+                        continue
+                    self._apply(record)
+                    self._records += 1
+        elif self.legacy_filename and os.path.exists(self.legacy_filename):
+            try:
+                with open(self.legacy_filename, "r", encoding="utf-8") as file:
+                    self.messages = json.load(file) or []
+            except (OSError, ValueError):
+                self.messages = []
+            torn = bool(self.messages)
+        self._file_state = self._stat()
+        if torn:
+            self.compact()
+
+    def _apply(self, record):
+        op = record.get("op")
+        if op == "add":
+            self.messages.append(record["message"])
+        elif op == "system":
+            if self.messages and self.messages[0]["role"] == "system":
+                self.messages[0]["content"] = record["content"]
+            else:
+                self.messages.insert(0, {"role": "system", "content": record["content"]})
+
+    def _sync(self):
+        if self._stat() != self._file_state:
+            self._load()
+
+    def _write(self, record):
+        with open(self.filename, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._records += 1
+        self._file_state = self._stat()
+
+    def get_history(self):
+        """Returns a copy of the current conversation history."""
+        with self._lock:
+            self._sync()
+            return [dict(message) for message in self.messages]
+
+    def append(self, message):
+        with self._lock:
+            self._sync()
+            record = {"op": "add", "message": message}
+            self._apply(record)
+            self._write(record)
+            if self._records - len(self.messages) > COMPACT_SLACK:
+                self.compact()
+
+    def set_system_message(self, content):
+        with self._lock:
+            self._sync()
+            record = {"op": "system", "content": content}
+            self._apply(record)
+            self._write(record)
+            if self._records - len(self.messages) > COMPACT_SLACK:
+                self.compact()
+
+    def truncate(self):
+        """Clears the history; the log is cut to zero bytes instead of rewritten."""
+        with self._lock:
+            with open(self.filename, "w", encoding="utf-8"):
+                pass
+            self.messages = []
+            self._records = 0
+            self._file_state = self._stat()
+
+    def compact(self):
+        """Rewrites the log with one record per message, atomically."""
+        with self._lock:
+            tmp_filename = self.filename + ".tmp"
+            with open(tmp_filename, "w", encoding="utf-8") as file:
+                for message in self.messages:
+                    file.write(json.dumps({"op": "add", "message": message}, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_filename, self.filename)
+            self._records = len(self.messages)
+            self._file_state = self._stat()
@@ -0,0 +1,65 @@
+import json
+import struct
+
+# Messages between the assistant daemon and its capture clients on the UNIX socket.
+# Each message is a 4 byte big endian header length, the JSON header, then
+# header["payload_size"] bytes of payload (PCM from the client, speech from the daemon).
+#
+# client -> daemon
+#   {"type": "hello", "room": "kitchen", "rate": 48000, "channels": 1}
+#   {"type": "segment", "stage": "hot-word" | "command"} + 16 bit PCM
+#   {"type": "bye"}
+# daemon -> client
+#   {"type": "session", "room": ..., "stage": ...}
+#   {"type": "audio", "text": ..., "extension": ".mp3"} + audio file bytes, once per clip
+#   {"type": "result", "transcript": ..., "hot_word": bool, "actions": [...], "stage": ..., "quit": bool}
+#   {"type": "error", "message": ...}
+
+DEFAULT_SOCKET = '/tmp/linux-voice-control.sock'  # unless config.json sets daemon-socket
+
+HEADER_LENGTH = struct.Struct('>I')
+MAX_HEADER_SIZE = 1 << 16
+MAX_PAYLOAD_SIZE = 64 << 20  # ~5 minutes of 48 kHz stereo PCM
+
+HOT_WORD_STAGE = 'hot-word'
+COMMAND_STAGE = 'command'
+
+
+class ProtocolError(Exception):
+    """Raised on a malformed message."""
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1 << 16))
+        if not chunk:
+            raise EOFError('connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def send_message(sock, header, payload=b''):
+    header = dict(header, payload_size=len(payload))
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(HEADER_LENGTH.pack(len(encoded)) + encoded)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """
+    @returns: (header dict, payload bytes)
+    @raises EOFError: when the peer closed the connection
+    """
+    (length,) = HEADER_LENGTH.unpack(_recv_exactly(sock, HEADER_LENGTH.size))
+    if length > MAX_HEADER_SIZE:
+        raise ProtocolError(f'header of {length} bytes')
+    try:
+        header = json.loads(_recv_exactly(sock, length).decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError(f'invalid header: {e}')
+    size = header.get('payload_size', 0)
+    if not isinstance(size, int) or not 0 <= size <= MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f'invalid payload size {size!r}')
+    return header, _recv_exactly(sock, size) if size else b''
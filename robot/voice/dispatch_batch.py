@@ -0,0 +1,95 @@
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+
+import click
+
+import command_manager
+import config_manager
+
+# Replays transcripts through the command dispatcher without executing anything
+# (command_manager.decide), e.g. to try a new commands.json on a day of utterances.
+#
+# The input has one utterance per line, either plain text or JSON objects such as
+#   {"text": "next track", "route": "spotify", "command": "next track"}
+# where "route" and "command" are the expected decision, used to measure accuracy.
+# Every decision is written as one JSON line with the time it took.
+#
+# usage (from robot/voice):
+#   python3 dispatch_batch.py transcripts.txt --output decisions.jsonl
+#   python3 dispatch_batch.py labelled.jsonl --commands new-commands.json
+
+
+def read_utterances(file):
+    """@returns: (text, expected dict or None) for every non-empty line"""
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            item = json.loads(line)
+            expected = {key: item[key] for key in ('route', 'command') if key in item}
+            yield item['text'], expected or None
+        else:
+            yield line, None
+
+
+# same normalization as main.analyze_text before launch_if_any
+def normalize(text):
+    text = text.lower().strip()
+    if text and text[-1] in " .!?":
+        text = text[:-1]
+    return text
+
+
+def is_correct(decision, expected):
+    return all(getattr(decision, key) == value for key, value in expected.items())
+
+
+@click.command()
+@click.argument("utterances", type=click.File("r"))
+@click.option("--output", type=click.File("w"), default="-", help="JSONL file for the decisions (stdout by default)")
+@click.option("--commands", "commands_file", default="commands.json", help="Commands file to dispatch against")
+def main(utterances, output, commands_file):
+    config_manager.init()
+    config_manager.config['show-commands-on-startup'] = False
+    command_manager.init(commands_file)
+
+    timings = []
+    routes = Counter()
+    labelled = correct = avoided = 0
+    started = time.perf_counter()
+    for text, expected in read_utterances(utterances):
+        before = time.perf_counter()
+        decision = command_manager.decide(normalize(text))
+        seconds = time.perf_counter() - before
+        timings.append(seconds)
+        routes[decision.route] += 1
+        avoided += "phrase" in decision.slots
+        record = {'text': text, 'route': decision.route, 'command': decision.command, 'score': decision.score,
+                  'slots': decision.slots, 'seconds': round(seconds, 6)}
+        if expected is not None:
+            labelled += 1
+            record['expected'] = expected
+            record['correct'] = is_correct(decision, expected)
+            correct += record['correct']
+        output.write(json.dumps(record) + '\n')
+    elapsed = time.perf_counter() - started
+
+    if not timings:
+        print('no utterances', file=sys.stderr)
+        return
+    timings.sort()
+    print(f'{len(timings)} utterances in {elapsed:.2f}s ({len(timings) / elapsed:.0f}/s), '
+          f'p50 {statistics.median(timings) * 1000:.2f}ms '
+          f'p95 {timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000:.2f}ms', file=sys.stderr)
+    print('routes: ' + ', '.join(f'{route}: {count}' for route, count in routes.most_common()), file=sys.stderr)
+    print(f'matched by the intent index instead of the AI: {avoided} ({routes["confirm"]} asking to confirm)', file=sys.stderr)
+    if labelled:
+        print(f'accuracy: {correct}/{labelled} ({correct / labelled:.1%})', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
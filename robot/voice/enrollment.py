@@ -0,0 +1,232 @@
+import glob
+import json
+import os
+import re
+import wave
+
+import numpy as np
+
+from vad import VoiceActivityDetector
+
+# Master mode voice samples, their speaker embeddings and quality scores
+TRAINING_DIR = 'training-data'
+EMBEDDINGS_DIR = os.path.join(TRAINING_DIR, 'master-mode-embeddings')
+READY_FILE = os.path.join(TRAINING_DIR, 'master-mode')  # master mode can be enabled once it exists
+SAMPLE_PREFIX = 'master_mode_audio_sample'
+CENTROID_FILE = 'centroid.npy'
+MANIFEST_FILE = 'manifest.json'
+
+MIN_SAMPLES = 3  # samples needed before master mode can be enabled
+MIN_SPEECH_SECONDS = 0.8  # speech a sample must contain to be accepted
+LOW_QUALITY = 0.5  # samples scoring below this are worth recording again
+
+
+class EnrollmentError(Exception):
+    """Raised when a sample is rejected, e.g. because it contains no speech."""
+
+
+def normalize(embedding):
+    return embedding / max(np.linalg.norm(embedding), 1e-6)
+
+
+def _file_state(filename):
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def sample_quality(vad_result, consistency):
+    """
+    Rates a sample from the amount of speech, how far it stands above the
+    background noise and how similar the voice is to the rest of the
+    enrollment (cosine similarity to their centroid).
+    @returns: the measurements and their combined score between 0 and 1
+    """
+    score = 0.4 * min(1.0, vad_result.speech_seconds / 2.0) \
+        + 0.3 * min(1.0, vad_result.snr_db / 30.0) \
+        + 0.3 * max(0.0, consistency)
+    return {
+        'speech_seconds': vad_result.speech_seconds,
+        'speech_ratio': round(vad_result.speech_ratio, 3),
+        'snr_db': round(vad_result.snr_db, 1),
+        'consistency': round(consistency, 3),
+        'score': round(score, 3),
+    }
+
+
+def read_wav(filename):
+    """@returns: (16 bit PCM bytes, rate, channels)"""
+    with wave.open(filename, 'rb') as wf:
+        return wf.readframes(wf.getnframes()), wf.getframerate(), wf.getnchannels()
+
+
+class EnrollmentStore:
+    """
+    The enrollment on disk: the WAV samples in @directory, one .npy
+    embedding per sample plus their centroid in @embeddings_directory, and
+    a manifest with the quality of every sample and the state of the WAV
+    its embedding was computed from, so edited samples are embedded again.
+    """
+
+    def __init__(self, directory=TRAINING_DIR, embeddings_directory=EMBEDDINGS_DIR, vad=None):
+        self.directory = directory
+        self.embeddings_directory = embeddings_directory
+        self.ready_file = os.path.join(directory, os.path.basename(READY_FILE))
+        self.vad = vad or VoiceActivityDetector()
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.embeddings_directory, MANIFEST_FILE), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return dict()
+
+    def _write_manifest(self):
+        os.makedirs(self.embeddings_directory, exist_ok=True)
+        path = os.path.join(self.embeddings_directory, MANIFEST_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def samples(self):
+        """@returns: the sample WAV paths, in recording order"""
+        def number(path):
+            match = re.search(r'(\d+)\.wav$', path)
+            return int(match.group(1)) if match else 0
+        return sorted(glob.glob(os.path.join(self.directory, f'{SAMPLE_PREFIX}*.wav')), key=number)
+
+    def _embedding_path(self, sample):
+        return os.path.join(self.embeddings_directory, os.path.splitext(os.path.basename(sample))[0] + '.npy')
+
+    def _next_sample_path(self):
+        numbers = [int(re.search(r'(\d+)\.wav$', path).group(1)) for path in self.samples()
+                   if re.search(r'(\d+)\.wav$', path)]
+        return os.path.join(self.directory, f'{SAMPLE_PREFIX}{max(numbers, default=0) + 1}.wav')
+
+    def quality(self, sample):
+        entry = self.manifest.get(os.path.basename(sample))
+        return entry.get('quality') if entry else None
+
+    def embeddings(self, embed_file):
+        """
+        Loads the embedding of every sample, computing the missing or stale
+        ones with @embed_file(path). Samples recorded before quality scores
+        existed are scored here.
+        @returns: (list of embeddings, centroid or None)
+        """
+        embeddings = []
+        unscored = []
+        changed = False
+        for sample in self.samples():
+            name = os.path.basename(sample)
+            entry = self.manifest.get(name)
+            path = self._embedding_path(sample)
+            if entry is not None and entry.get('state') == _file_state(sample) and os.path.exists(path):
+                embeddings.append(np.load(path))
+                continue
+            embedding = normalize(embed_file(sample))
+            self._save(path, embedding)
+            self.manifest[name] = {'state': _file_state(sample),
+                                   'quality': entry.get('quality') if entry else None}
+            embeddings.append(embedding)
+            changed = True
+        for sample, embedding in zip(self.samples(), embeddings):
+            if self.quality(sample) is None:
+                unscored.append((sample, embedding))
+        names = {os.path.basename(sample) for sample in self.samples()}
+        for name in list(self.manifest):
+            if name not in names:
+                del self.manifest[name]
+                changed = True
+        centroid = self._update_centroid(embeddings)
+        for sample, embedding in unscored:
+            pcm, rate, channels = read_wav(sample)
+            quality = sample_quality(self.vad.analyze(pcm, rate, channels), float(np.dot(centroid, embedding)))
+            self.manifest[os.path.basename(sample)]['quality'] = quality
+            changed = True
+        if changed:
+            self._write_manifest()
+        return embeddings, centroid
+
+    def _save(self, path, embedding):
+        os.makedirs(self.embeddings_directory, exist_ok=True)
+        np.save(path, embedding)
+
+    def _update_centroid(self, embeddings):
+        path = os.path.join(self.embeddings_directory, CENTROID_FILE)
+        if not embeddings:
+            if os.path.exists(path):
+                os.remove(path)
+            return None
+        centroid = normalize(np.mean(embeddings, axis=0))
+        self._save(path, centroid)
+        return centroid
+
+    def add(self, pcm, rate, channels, embedding, quality):
+        """Stores a new sample with its embedding and quality. @returns: the WAV path"""
+        os.makedirs(self.directory, exist_ok=True)
+        sample = self._next_sample_path()
+        with wave.open(sample, 'wb') as wf:
+            wf.setnchannels(channels)
+            wf.setsampwidth(2)
+            wf.setframerate(rate)
+            wf.writeframes(pcm)
+        self._save(self._embedding_path(sample), normalize(embedding))
+        self.manifest[os.path.basename(sample)] = {'state': _file_state(sample), 'quality': quality}
+        self._write_manifest()
+        return sample
+
+    def remove(self, sample):
+        """Deletes a sample and its embedding."""
+        sample = os.path.join(self.directory, os.path.basename(sample))
+        for path in (sample, self._embedding_path(sample)):
+            if os.path.exists(path):
+                os.remove(path)
+        self.manifest.pop(os.path.basename(sample), None)
+        self._write_manifest()
+        if not self.is_ready() and os.path.exists(self.ready_file):
+            os.remove(self.ready_file)
+
+    def is_ready(self):
+        return len(self.samples()) >= MIN_SAMPLES
+
+    def mark_ready(self):
+        open(self.ready_file, 'w').close()
+
+
+class Enrollment:
+    """
+    Adds master mode samples one at a time: each one is checked for speech
+    with the VAD, embedded with the resident speaker model, scored and
+    stored, so a weak sample can be replaced without recording the whole
+    set again. @verifier is a master_mode_manager.SpeakerVerifier.
+    """
+
+    def __init__(self, verifier, store=None, vad=None):
+        self.verifier = verifier
+        self.store = store or verifier.store
+        self.vad = vad or self.store.vad
+
+    def add_sample(self, pcm, rate, channels=1):
+        """
+        Validates and stores 16 bit PCM audio of the master's voice.
+        @returns: (sample path, quality dict)
+        @raises EnrollmentError: if the clip does not contain enough speech
+        """
+        analysis = self.vad.analyze(pcm, rate, channels)
+        if analysis.speech_seconds < MIN_SPEECH_SECONDS:
+            raise EnrollmentError(f'only {analysis.speech_seconds:.1f}s of speech, '
+                                  f'at least {MIN_SPEECH_SECONDS}s are needed')
+        embedding = normalize(self.verifier.embed_pcm(pcm, rate, channels))
+        centroid = self.verifier.centroid
+        consistency = float(np.dot(centroid, embedding)) if centroid is not None else 1.0
+        quality = sample_quality(analysis, consistency)
+        sample = self.store.add(pcm, rate, channels, embedding, quality)
+        self.verifier.reload()
+        if self.store.is_ready():
+            self.store.mark_ready()
+        return sample, quality
+
+    def remove_sample(self, sample):
+        self.store.remove(sample)
+        self.verifier.reload()
@@ -0,0 +1,64 @@
+import numpy as np
+
+SAMPLE_WIDTH = 2  # bytes per int16 sample
+
+
+class FrameBuffer:
+    """
+    The samples of the segment being recorded, in one int16 array that is
+    reused from one segment to the next and only reallocated (doubling) when
+    a segment outgrows it. Chunks are copied straight into the array through
+    a memoryview, and the segment is handed downstream as a view, valid
+    until the next clear().
+
+    @allocations and @bytes_copied count the work done since creation, so
+    the cost per segment can be measured.
+    """
+
+    def __init__(self, capacity=16000 * 10):
+        self._samples = np.empty(capacity, dtype=np.int16)
+        self._bytes = memoryview(self._samples).cast('B')
+        self.length = 0  # samples
+        self.allocations = 1
+        self.bytes_copied = 0
+
+    @property
+    def capacity(self):
+        return len(self._samples)
+
+    def clear(self):
+        self.length = 0
+
+    def _reserve(self, samples):
+        if self.length + samples <= len(self._samples):
+            return
+        capacity = len(self._samples)
+        while capacity < self.length + samples:
+            capacity *= 2
+        grown = np.empty(capacity, dtype=np.int16)
+        grown[:self.length] = self._samples[:self.length]
+        self._samples = grown
+        self._bytes = memoryview(grown).cast('B')
+        self.allocations += 1
+        self.bytes_copied += self.length * SAMPLE_WIDTH
+
+    def append(self, data):
+        """
+        Copies 16 bit PCM bytes (e.g. a chunk read from PyAudio) to the end.
+        @returns: the appended samples, a view into the buffer
+        """
+        samples = len(data) // SAMPLE_WIDTH
+        self._reserve(samples)
+        start = self.length * SAMPLE_WIDTH
+        self._bytes[start:start + samples * SAMPLE_WIDTH] = memoryview(data)[:samples * SAMPLE_WIDTH]
+        self.bytes_copied += samples * SAMPLE_WIDTH
+        self.length += samples
+        return self._samples[self.length - samples:self.length]
+
+    def samples(self):
+        """@returns: the segment's int16 samples, a view into the buffer"""
+        return self._samples[:self.length]
+
+    def pcm(self):
+        """@returns: the segment as 16 bit PCM, a bytes-like memoryview into the buffer"""
+        return self._bytes[:self.length * SAMPLE_WIDTH]
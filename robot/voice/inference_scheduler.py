@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import whisper
+
+import metrics
+from sampling_profiler import profiled
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16)
+QUEUE_WAIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)  # seconds
+
+# whisper.transcribe's defaults: a decoding that compresses too well (a loop) or is too
+# unlikely is sampled again at the next temperature, unless the window is silence
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+# result of an utterance longer than one 30 second window, with the confidence of its segments:
+# the mean log probability, the lowest no-speech probability and the highest compression ratio
+Transcript = namedtuple('Transcript', ['text', 'avg_logprob', 'no_speech_prob', 'compression_ratio'])
+
+
+class TranscriptionCancelled(Exception):
+    """Raised for an utterance whose cancel event was set before it was decoded."""
+
+
+def needs_fallback(result):
+    """@returns: True if whisper.transcribe would decode the window again at a higher temperature"""
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+        return False  # silence, nothing better to find
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+
+def _transcript(output):
+    segments = output['segments']
+    if not segments:
+        return Transcript(output['text'], 0.0, 1.0, 0.0)
+    return Transcript(output['text'],
+                      sum(segment['avg_logprob'] for segment in segments) / len(segments),
+                      min(segment['no_speech_prob'] for segment in segments),
+                      max(segment['compression_ratio'] for segment in segments))
+
+
+class InferenceJob:
+    """
+    One utterance waiting for the model. @future resolves to Whisper's
+    DecodingResult (a Transcript past 30 seconds); @cpu_time is the share of the batches' CPU time spent
+    on it, kept up to date until the future is done.
+    """
+
+    def __init__(self, audio, cancel_event, language):
+        self.audio = audio
+        self.cancel_event = cancel_event
+        self.language = language
+        self.submitted = time.monotonic()
+        self.cpu_time = 0.0
+        self.future = Future()
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+
+class InferenceScheduler:
+    """
+    Runs Whisper for every caller on one worker thread, so the model is never
+    used concurrently. Utterances submitted within @max_wait seconds of the
+    oldest pending one are padded to 30 seconds and go through the encoder
+    and the decoder together, up to @max_batch at a time, which keeps the
+    cores busy when several sessions finish speaking at once. Results that
+    whisper.transcribe would not accept are decoded again one by one with
+    its temperature fallback, and utterances longer than 30 seconds are
+    left to whisper.transcribe.
+    """
+
+    def __init__(self, model, max_batch=8, max_wait=0.01):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, audio, cancel_event=None, language='en'):
+        """Queues 16 kHz mono float samples. @returns: the InferenceJob"""
+        job = InferenceJob(audio, cancel_event, language)
+        with self._condition:
+            self._pending.append(job)
+            self._condition.notify()
+        return job
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            # the oldest utterance never waits longer than max_wait for company
+            deadline = self._pending[0].submitted + self.max_wait
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            language = self._pending[0].language
+            batch = [job for job in self._pending if job.language == language][:self.max_batch]
+            for job in batch:
+                self._pending.remove(job)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            now = time.monotonic()
+            for job in batch:
+                metrics.observe('asr.queue_wait', now - job.submitted)
+                metrics.histogram('asr.queue_wait', now - job.submitted, QUEUE_WAIT_BUCKETS)
+            metrics.histogram('asr.batch_size', len(batch), BATCH_SIZE_BUCKETS)
+            try:
+                with metrics.timer('asr.batch'):
+                    self._process(batch)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+
+    def _drop_cancelled(self, batch):
+        """Fails the cancelled jobs. @returns: the indices of the others"""
+        keep = []
+        for index, job in enumerate(batch):
+            if job.cancelled():
+                metrics.increment('asr.cancelled')
+                job.future.set_exception(TranscriptionCancelled())
+            else:
+                keep.append(index)
+        return keep
+
+    def _charge(self, batch, started):
+        share = (time.thread_time() - started) / len(batch)
+        for job in batch:
+            job.cpu_time += share
+
+    @profiled('asr')
+    def _process(self, batch):
+        batch = [batch[index] for index in self._drop_cancelled(batch)]
+        if not batch:
+            return
+        model = self.model
+        fp16 = model.device.type == 'cuda'
+
+        # longer than one window: chunked by whisper.transcribe, on its own
+        for job in [job for job in batch if len(job.audio) > whisper.audio.N_SAMPLES]:
+            metrics.increment('asr.long')
+            started = time.thread_time()
+            output = model.transcribe(job.audio, language=job.language, fp16=fp16, temperature=TEMPERATURES)
+            job.cpu_time += time.thread_time() - started
+            job.future.set_result(_transcript(output))
+        batch = [job for job in batch if len(job.audio) <= whisper.audio.N_SAMPLES]
+        if not batch:
+            return
+
+        started = time.thread_time()
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(
+                whisper.pad_or_trim(torch.from_numpy(np.ascontiguousarray(job.audio, dtype=np.float32))),
+                n_mels=model.dims.n_mels)
+            for job in batch]).to(model.device)
+        if fp16:
+            mel = mel.half()
+        with torch.no_grad():
+            features = model.embed_audio(mel)
+        self._charge(batch, started)
+
+        # utterances rejected while encoding skip the decoder
+        keep = self._drop_cancelled(batch)
+        if not keep:
+            return
+        if len(keep) < len(batch):
+            batch = [batch[index] for index in keep]
+            features = features[keep]
+
+        started = time.thread_time()
+        # decode() skips the encoder when it is given the audio features
+        options = whisper.DecodingOptions(language=batch[0].language, without_timestamps=True, fp16=fp16)
+        results = whisper.decode(model, features, options)
+        self._charge(batch, started)
+        for index, (job, result) in enumerate(zip(batch, results)):
+            if needs_fallback(result):
+                result = self._decode_with_fallback(job, features[index:index + 1], result)
+                if result is None:
+                    continue
+            job.future.set_result(result)
+
+    def _decode_with_fallback(self, job, features, result):
+        """
+        Samples the utterance again at increasing temperatures until a result is acceptable.
+        @returns: the last result, None if the job was cancelled meanwhile
+        """
+        for temperature in TEMPERATURES[1:]:
+            if job.cancelled():
+                metrics.increment('asr.cancelled')
+                job.future.set_exception(TranscriptionCancelled())
+                return None
+            metrics.increment('asr.fallback')
+            started = time.thread_time()
+            options = whisper.DecodingOptions(language=job.language, without_timestamps=True,
+                                              fp16=self.model.device.type == 'cuda',
+                                              temperature=temperature, best_of=5)
+            result = whisper.decode(self.model, features, options)[0]
+            job.cpu_time += time.thread_time() - started
+            if not needs_fallback(result):
+                break
+        return result
@@ -0,0 +1,110 @@
+import json
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+import numpy as np
+
+# Local matcher for utterances the fuzzy matcher rejects, mostly ASR misspellings
+# ("paws music") and rewordings ("skip this song") of known commands
+
+PARAPHRASES_FILE = 'paraphrases.json'
+NGRAM_SIZES = (2, 3, 4)
+
+# command: the commands.json key, phrase: the indexed phrase that matched, score: cosine similarity 0-1
+IntentMatch = namedtuple('IntentMatch', ['command', 'phrase', 'score'])
+
+
+def ngrams(text):
+    """@returns: the character n-gram counts of the normalized text, padded to mark word boundaries"""
+    text = ' ' + re.sub(r'[^a-z0-9]+', ' ', text.lower()).strip() + ' '
+    return Counter(text[start:start + size] for size in NGRAM_SIZES for start in range(len(text) - size + 1))
+
+
+def load_paraphrases(filename=PARAPHRASES_FILE):
+    """@returns: {command: [paraphrase, ...]} from the paraphrases file, empty when there is none"""
+    try:
+        with open(os.path.join(os.getcwd(), filename), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+
+class IntentIndex:
+    """
+    Character n-gram TF-IDF vectors of every command phrase and paraphrase,
+    stored as an inverted index (one posting list of phrases and weights per
+    n-gram, CSC layout), so scoring an utterance against all phrases is a
+    single sparse dot product over the n-grams it contains.
+    """
+
+    def __init__(self, phrases):
+        # @phrases: [(phrase, command)], several phrases may lead to the same command
+        self.phrases = [phrase for phrase, _ in phrases]
+        self.commands = [command for _, command in phrases]
+        counts = [ngrams(phrase) for phrase in self.phrases]
+        vocabulary = sorted({gram for count in counts for gram in count})
+        self.vocabulary = {gram: index for index, gram in enumerate(vocabulary)}
+
+        document_frequency = np.zeros(len(vocabulary))
+        for count in counts:
+            for gram in count:
+                document_frequency[self.vocabulary[gram]] += 1
+        # smoothed idf, an n-gram seen nowhere weighs as much as one seen in a single phrase
+        self.idf = np.log((1 + len(counts)) / (1 + document_frequency)) + 1
+        self.unknown_idf = math.log(1 + len(counts)) + 1
+
+        postings = [[] for _ in vocabulary]
+        for row, count in enumerate(counts):
+            weights = {self.vocabulary[gram]: (1 + math.log(n)) * self.idf[self.vocabulary[gram]]
+                       for gram, n in count.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for column, weight in weights.items():
+                postings[column].append((row, weight / norm))
+        self.indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(posting) for posting in postings])
+        self.rows = np.array([row for posting in postings for row, _ in posting], dtype=np.int64)
+        self.weights = np.array([weight for posting in postings for _, weight in posting])
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def scores(self, text):
+        """@returns: the cosine similarity of the text to every indexed phrase"""
+        columns = []
+        values = []
+        norm = 0.0
+        for gram, n in ngrams(text).items():
+            column = self.vocabulary.get(gram)
+            weight = (1 + math.log(n)) * (self.idf[column] if column is not None else self.unknown_idf)
+            norm += weight * weight
+            if column is not None:
+                columns.append(column)
+                values.append(weight)
+        if not columns or norm == 0:
+            return np.zeros(len(self.phrases))
+        columns = np.array(columns)
+        starts = self.indptr[columns]
+        lengths = self.indptr[columns + 1] - starts
+        # positions of all the query n-grams' postings, gathered at once
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        weights = self.weights[positions] * np.repeat(values, lengths)
+        return np.bincount(self.rows[positions], weights=weights, minlength=len(self.phrases)) / math.sqrt(norm)
+
+    def match(self, text):
+        """@returns: the IntentMatch of the closest phrase, None for an empty index"""
+        if not self.phrases:
+            return None
+        scores = self.scores(text)
+        best = int(np.argmax(scores))
+        return IntentMatch(self.commands[best], self.phrases[best], float(scores[best]))
+
+
+def build(commands, paraphrases):
+    """Indexes the command phrases without wildcards and their paraphrases."""
+    phrases = [(command, command) for command in commands if '*' not in command]
+    for command, rewordings in paraphrases.items():
+        if command in commands and '*' not in command:
+            phrases.extend((phrase, command) for phrase in rewordings)
+    return IntentIndex(phrases)
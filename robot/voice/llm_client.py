@@ -0,0 +1,221 @@
+import json
+import queue
+import threading
+import time
+
+import requests
+
+MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
+MOCK_API_URL = "http://127.0.0.1:8089/v1/chat/completions"
+
+
+class LLMError(Exception):
+    """Raised when the backend fails or returns an error status."""
+
+
+class LLMCancelled(LLMError):
+    """Raised when a request was cancelled, e.g. because the user spoke again."""
+
+
+class LLMDeadlineExceeded(LLMError):
+    """Raised when a request did not finish before its deadline."""
+
+
+class OpenAICompatibleBackend:
+    """
+    Talks to any server implementing the OpenAI-style /chat/completions API
+    with server-sent events, which covers Mistral and the local mock server.
+    """
+
+    def __init__(self, name, url, model, api_key=None):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+
+    def _headers(self, stream):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        if stream:
+            headers["Accept"] = "text/event-stream"
+        return headers
+
+    def open_stream(self, body, timeout):
+        """Sends the JSON encoded @body and returns the streaming response."""
+        return requests.post(self.url, headers=self._headers(True), data=body, stream=True, timeout=timeout)
+
+    @staticmethod
+    def iter_tokens(response):
+        """Yields the content of every SSE chunk of the @response."""
+        for line in response.iter_lines():
+            if not line:
+                continue
+            line = line.decode('utf-8')
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                return
+            try:
+                json_data = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
+            if content:
+                yield content
+
+    def complete(self, payload, timeout):
+        """Sends a non-streaming request and returns the answer text."""
+        payload = dict(payload, model=self.model, stream=False)
+        try:
+            response = requests.post(self.url, headers=self._headers(False), json=payload, timeout=timeout)
+        except requests.Timeout as e:
+            raise LLMDeadlineExceeded(str(e))
+        except requests.RequestException as e:
+            raise LLMError(str(e))
+        if response.status_code != 200:
+            raise LLMError(f"{response.status_code} - {response.text}")
+        try:
+            return response.json()["choices"][0]["message"]["content"].strip()
+        except (KeyError, IndexError, ValueError) as e:
+            raise LLMError(f"unexpected response: {e}")
+
+
+# Available backends, selected with "backend" in ai_config.json
+def create_backend(name, api_key=None, mock_url=MOCK_API_URL):
+    if name == "mistral":
+        return OpenAICompatibleBackend("mistral", MISTRAL_API_URL, "mistral-medium", api_key)
+    if name == "mock":
+        return OpenAICompatibleBackend("mock", mock_url, "mock")
+    raise ValueError(f"unknown LLM backend: {name}")
+
+
+class LLMRequest:
+    """
+    A streaming completion running on its own thread. Iterating over the
+    request yields tokens as they arrive; it raises LLMCancelled or
+    LLMDeadlineExceeded if the request is cancelled or runs out of time.
+    """
+
+    def __init__(self, backend, payload, deadline, connect_timeout):
+        self.backend = backend
+        self.payload = dict(payload, model=backend.model, stream=True)
+        self.body = json.dumps(self.payload).encode("utf-8")
+        self.deadline = time.monotonic() + deadline
+        self.connect_timeout = connect_timeout
+        self.started = time.monotonic()
+        self.first_token_time = None
+        self._tokens = queue.Queue()
+        self._response = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        """True once the stream has been fully received, failed or was cancelled."""
+        return self._done.is_set()
+
+    def cancel(self):
+        """Stops the request, closing the connection so a blocked read returns at once."""
+        self._cancelled.set()
+        response = self._response
+        if response is not None:
+            response.close()
+        self._tokens.put(None)
+
+    def _run(self):
+        try:
+            read_timeout = max(0.1, self.deadline - time.monotonic())
+            self._response = self.backend.open_stream(self.body, (self.connect_timeout, read_timeout))
+            if self.cancelled:
+                self._response.close()
+                return
+            if self._response.status_code != 200:
+                self._error = LLMError(f"{self._response.status_code} - {self._response.text}")
+                return
+            for token in self.backend.iter_tokens(self._response):
+                if self.cancelled:
+                    return
+                if self.first_token_time is None:
+                    self.first_token_time = time.monotonic()
+                self._tokens.put(token)
+        except Exception as e:
+            # Closing the connection from another thread makes the pending read fail
+            # in various ways, none of which matter once the request is cancelled
+            if self.cancelled:
+                pass
+            elif isinstance(e, requests.Timeout) or time.monotonic() >= self.deadline:
+                self._error = LLMDeadlineExceeded(str(e))
+            else:
+                self._error = LLMError(str(e))
+        finally:
+            if self._response is not None:
+                self._response.close()
+            self._done.set()
+            self._tokens.put(None)
+
+    def __iter__(self):
+        while True:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                self.cancel()
+                raise LLMDeadlineExceeded("no answer before the deadline")
+            try:
+                token = self._tokens.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if self.cancelled:
+                raise LLMCancelled("request cancelled")
+            if token is None:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield token
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.started
+
+
+class LLMClient:
+    """
+    Starts streaming requests on a backend. Only one request is active at a
+    time: starting a new one cancels the previous one.
+    """
+
+    def __init__(self, backend, deadline=20.0, connect_timeout=5.0):
+        self.backend = backend
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self._active = None
+        self._lock = threading.Lock()
+
+    def stream(self, payload, deadline=None):
+        request = LLMRequest(self.backend, payload, deadline or self.deadline, self.connect_timeout)
+        with self._lock:
+            previous, self._active = self._active, request
+        if previous is not None:
+            previous.cancel()
+        return request
+
+    def cancel_active(self):
+        """Cancels the running request, if any. @returns True if one was cancelled."""
+        with self._lock:
+            request, self._active = self._active, None
+        if request is None or request.done:
+            return False
+        request.cancel()
+        return True
+
+    def complete(self, payload, deadline=None):
+        return self.backend.complete(payload, (self.connect_timeout, deadline or self.deadline))
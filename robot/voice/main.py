@@ -1,8 +1,7 @@
+import atexit
 import os
 import sys
 import time
-import wave
-from array import array
 from os.path import exists
 
 import click
@@ -11,12 +10,19 @@ import whisper
 import torch
 from termcolor import cprint
 
+import ai_functions
+import audio_output
 import basic_mode_manager
+import capture
 import command_manager
 import config_manager
+import master_mode_manager
+import metrics
+import network_monitor
+import recognition
+import sampling_profiler
 import voice_feedback
-from master_mode_manager import isMasterSpeaking
-from utils import trim
+from capture import record_until_silence
 
 try:
     if not exists('misc'):
@@ -38,74 +44,17 @@ def log(text, color=None, attrs=None):
         cprint(text, color, attrs=attrs)
 
 
-def detect_silence(audio_data, threshold, silence_duration, rate, chunk):
-    """
-    Detects silence in the audio.
-    :param audio_data: Audio data (array of amplitudes).
-    :param threshold: Amplitude threshold to consider silence.
-    :param silence_duration: Minimum duration of silence (in seconds).
-    :param rate: Audio sample rate.
-    :param chunk: Audio chunk size.
-    :return: True if silence is detected, False otherwise.
-    """
-    silent_chunks = 0
-    required_silent_chunks = int(silence_duration * rate / chunk)
-
-    for amplitude in audio_data:
-        if abs(amplitude) < threshold:
-            silent_chunks += 1
-            if silent_chunks >= required_silent_chunks:
-                return True
-        else:
-            silent_chunks = 0
-
-    return False
-
-
-def record_until_silence(stream, chunk, format, channels, rate, threshold, silence_duration, is_hotword=False):
-    """
-    Records audio until silence is detected and at least 3 seconds of audio are recorded.
-    :return: List of audio frames.
-    """
-    frames = []
-    silent_chunks = 0
-    required_silent_chunks = int(silence_duration * rate / chunk)
-    start_time = time.time()  # Starts the timer
-
-    log("Waiting command..." if not is_hotword else "Waiting hot word...", "blue" if not is_hotword else "yellow", attrs=["bold"])
-
-    while True:
-        data = stream.read(chunk, exception_on_overflow=False)
-        frames.append(data)
-        audio_data = array('h', data)
-        audio_data = trim(audio_data)
-
-        if len(audio_data) == 0:
-            continue
-
-        # Checks if the audio is below the silence threshold
-        if max(audio_data) < threshold:
-            silent_chunks += 1
-        else:
-            silent_chunks = 0
-
-        # If it's a hot-word, sends the audio every x seconds
-        if is_hotword and (time.time() - start_time) >= 1.2:
-            break
-
-        # Checks if silence is detected and if at least 3 seconds have passed
-        if not is_hotword and silent_chunks >= required_silent_chunks and (time.time() - start_time) >= 3.0:
-            break
-
-    return frames
-
-
 @click.command()
 @click.option("--model", default="base", help="Model to use",
               type=click.Choice(["tiny", "base", "small", "medium", "large"]))
 @click.option("--ui", default="false", help="Launch in UI Mode [true/false]",
               type=click.Choice(["true", "false"]))
-def main(model='base', ui='false'):
+@click.option("--profile", is_flag=True, help="Sample the running assistant and write flamegraphs to profiles/")
+@click.option("--profile-stage", default=None, help="Only sample this stage",
+              type=click.Choice(sampling_profiler.STAGES))
+@click.option("--profile-every", default=10, help="Utterances per written profile")
+@click.option("--profile-interval", default=0.005, help="Seconds of CPU time between samples")
+def main(model='base', ui='false', profile=False, profile_stage=None, profile_every=10, profile_interval=0.005):
     """
     Main function of the program.
     """
@@ -115,6 +64,19 @@ def main(model='base', ui='false'):
     # Initializes configuration management
     config_manager.init()
 
+    # Samples the live loop, the profile of the last utterances is written on exit
+    if profile:
+        profiler = sampling_profiler.SamplingProfiler(profile_interval, profile_every, profile_stage)
+        profiler.start()
+        atexit.register(profiler.stop)
+
+    # Latency and counter summary when the assistant exits
+    if config_manager.config['logs']:
+        atexit.register(metrics.report)
+
+    # Connectivity is probed in the background, the speech, weather and AI modules follow it
+    network_monitor.init(config_manager.config)
+
     # Initial greetings
     voice_feedback.init()
 #   voice_feedback.greet() # activate it if you want a greeting
@@ -138,22 +100,34 @@ def main(model='base', ui='false'):
     SILENCE_DURATION = 0.8  # Minimum duration of silence to stop recording (in seconds)
 
     # Opens the audio stream
-    stream = pyAudio.open(format=FORMAT,
-                          channels=CHANNELS,
-                          rate=RATE,
-                          input=True,
-                          frames_per_buffer=CHUNK)
+    stream = capture.open_stream(pyAudio, config_manager.config)
+
+    # Keeps recording while hot words are transcribed and acknowledged
+    continuous = config_manager.config.get('continuous-capture', False)
+    if continuous:
+        # the user may talk over the assistant, see over_speech()
+        stream = capture.ContinuousStream(stream, CHUNK, CHANNELS, RATE, speaking=voice_feedback.is_speaking).start()
+        voice_feedback.get_earcon()
 
     log("🐧 Loading command file...", "blue")
 
     # Initializes command management
     command_manager.init()
 
+    # Pre-synthesizes every fixed phrase in the background so it plays instantly, even offline
+    voice_feedback.warm_up_cache(voice_feedback.get_static_speeches() + command_manager.get_static_speeches() + [
+        'Yes Master ...',
+        'Master mode enabled, waiting for command...',
+        'Configure master mode before using it!',
+    ])
+
     # Master mode
     if config_manager.config['master-mode']:
         enabled = os.path.exists('training-data/master-mode')
         if enabled:
             log(f'MASTER MODE: ENABLED', "blue", attrs=['bold'])
+            # Keeps the speaker model and the enrollment embeddings resident
+            master_mode_manager.get_verifier(config_manager.config.get('master-mode-threshold', 0.25))
             voice_feedback.speak('Master mode enabled, waiting for command...', wait=True)
         else:
             config_manager.config['master-mode'] = False
@@ -162,59 +136,78 @@ def main(model='base', ui='false'):
 
     # Basic mode with hot word
     if config_manager.config['use-hot-word-in-basic-mode']:
+        wake_plus_command = config_manager.config.get('wake-plus-command', False)
         while True:
-            frames = record_until_silence(stream, CHUNK, FORMAT, CHANNELS, RATE, SPEECH_THRESHOLD, SILENCE_DURATION, is_hotword=True)
-
-            # Saves the recorded audio
-            wf = wave.open('training-data/hot-word-data.wav', 'wb')
-            wf.setnchannels(CHANNELS)
-            wf.setsampwidth(pyAudio.get_sample_size(FORMAT))
-            wf.setframerate(RATE)
-            wf.writeframes(b''.join(frames))
-            wf.close()
-
-            # Transcribes the audio
-            result = audio_model.transcribe('training-data/hot-word-data.wav', fp16=False, language='english')
-            text = result["text"].lower().strip()
-            text = "".join([ch for ch in text if ch.isalpha() or ch.isdigit() or ch == ' ']).lower()
-
-            if basic_mode_manager.compare(text):
+            pcm = record_until_silence(stream, CHUNK, FORMAT, CHANNELS, RATE, SPEECH_THRESHOLD, SILENCE_DURATION, is_hotword=True,
+                                       extend=wake_plus_command)
+
+            # Transcribes the audio, with the command when it was said in the same breath
+            command = ''
+            if wake_plus_command:
+                hot_word, command = recognition.transcribe_wake_and_command(audio_model, pcm, RATE, CHANNELS)
+                command = over_speech(stream, pcm, command)
+            else:
+                hot_word = basic_mode_manager.compare(recognition.transcribe_hot_word(audio_model, pcm, RATE, CHANNELS))
+
+            if command:
+                log("Hot word and command detected...", "magenta", attrs=["bold"])
+                metrics.increment('capture.wake_plus_command')
+                analyze_text(command)
+                sampling_profiler.utterance_done()
+                if continuous:
+                    stream.skip_to_live()
+            elif hot_word:
                 log("Hot word detected...", "magenta", attrs=["bold"])
-                voice_feedback.speak('Yes Master ...', wait=True)
-                frames = record_until_silence(stream, CHUNK, FORMAT, CHANNELS, RATE, SPEECH_THRESHOLD, SILENCE_DURATION)
-
-                # Saves the command audio
-                wf = wave.open('misc/last-mic-fetch.wav', 'wb')
-                wf.setnchannels(CHANNELS)
-                wf.setsampwidth(pyAudio.get_sample_size(FORMAT))
-                wf.setframerate(RATE)
-                wf.writeframes(b''.join(frames))
-                wf.close()
+                detected = time.perf_counter()
+                if continuous:
+                    # The command starts with what was said right after (or during) the hot word
+                    voice_feedback.play_earcon()
+                    stream.rewind(config_manager.config.get('pre-roll-seconds', 0.5))
+                else:
+                    voice_feedback.speak('Yes Master ...', wait=True, priority=audio_output.URGENT)
+                metrics.observe('capture.wake_to_command', time.perf_counter() - detected)
+                pcm = record_until_silence(stream, CHUNK, FORMAT, CHANNELS, RATE, SPEECH_THRESHOLD, SILENCE_DURATION)
 
                 # Transcribes and processes the command
-                result = audio_model.transcribe('misc/last-mic-fetch.wav', fp16=False, language='english')
-                text = result["text"].lower().strip()
+                text = over_speech(stream, pcm, recognition.transcribe_command(audio_model, pcm, RATE, CHANNELS))
                 analyze_text(text)
+                sampling_profiler.utterance_done()
+                if continuous:
+                    # What was said while the command was handled is dropped
+                    stream.skip_to_live()
             else:
                 log('Hot word not detected.', "red", attrs=['bold'])
-                time.sleep(0.5)
+                if not continuous:
+                    time.sleep(0.5)
     else:
         log(f'🚀 Voice control ready...', "blue")
         while True:
-            frames = record_until_silence(stream, CHUNK, FORMAT, CHANNELS, RATE, SPEECH_THRESHOLD, SILENCE_DURATION)
-
-            # Saves the recorded audio
-            wf = wave.open('misc/last-mic-fetch.wav', 'wb')
-            wf.setnchannels(CHANNELS)
-            wf.setsampwidth(pyAudio.get_sample_size(FORMAT))
-            wf.setframerate(RATE)
-            wf.writeframes(b''.join(frames))
-            wf.close()
+            pcm = record_until_silence(stream, CHUNK, FORMAT, CHANNELS, RATE, SPEECH_THRESHOLD, SILENCE_DURATION)
 
             # Transcribes and processes the command
-            result = audio_model.transcribe('misc/last-mic-fetch.wav', fp16=False, language='english')
-            text = result["text"].lower().strip()
+            text = over_speech(stream, pcm, recognition.transcribe_command(audio_model, pcm, RATE, CHANNELS))
             analyze_text(text)
+            sampling_profiler.utterance_done()
+            if continuous:
+                stream.skip_to_live()
+
+
+def over_speech(stream, pcm, text):
+    """
+    In continuous mode the assistant's own voice is recorded too: of a segment recorded
+    while it spoke, only a stop phrase said over it is kept, which silences the speech
+    and cancels the AI answer.
+    :return: The text to analyze, empty when it is dropped.
+    """
+    if not text or not isinstance(stream, capture.ContinuousStream):
+        return text
+    if not stream.during_speech(len(pcm) // capture.SAMPLE_WIDTH):
+        return text
+    phrase = command_manager.stop_phrase(text)
+    if phrase is None:
+        log(f'Ignored while speaking: {text}', "yellow")
+        metrics.increment('capture.dropped_over_speech')
+    return phrase or ''
 
 
 def analyze_text(text):
@@ -226,6 +219,10 @@ def analyze_text(text):
 
     log(f'You: {text}', "blue", attrs=["bold"])
 
+    # A new command supersedes the AI answer still streaming or being spoken
+    if ai_functions.cancel_active_request():
+        log("Cancelled the previous AI request.", "yellow")
+
     if text[-1] in " .!?":
         text = text[:-1]
 
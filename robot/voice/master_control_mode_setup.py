@@ -1,131 +1,113 @@
 import os
-import wave
-from array import array
-from os.path import exists
 
+import click
 import pyaudio
-import whisper
 from termcolor import cprint
 
+import capture
 import config_manager
-from utils import trim
-
-config_manager.init()
-
-# initializing PyAudio ...
-pyAudio = pyaudio.PyAudio()
-
-# Opening Microphone Stream with above created configuration ...
-stream = pyAudio.open(format=pyaudio.paInt16,
-                      channels=2,
-                      rate=44100,
-                      input=True,
-                      frames_per_buffer=1024)
-
-training_data_set = dict()
-
-try:
-    if not exists('training-data'):
-        os.mkdir('training-data')
-except Exception as e:
-    print('unable to create training directory')
-    exit(1)
-
-
-# records the mic and provides transcription result
-# @returns: bytes of audio data
-def listen():
-    dataframes = []
-    audio_chunks = array('h')
-    cprint("listening ...", "blue", attrs=["bold"])
-    for i in range(0, int(44100 / 1024 * 3)):
-        data = stream.read(1024, exception_on_overflow=False)
-        dataframes.append(data)  # stacking every audio frame into the list
-        audio_chunks.extend(array('h', data))
-    audio_chunks = trim(audio_chunks)
-    if len(audio_chunks) == 0:  # clip is empty
-        print('no voice')
-        return None
-    elif max(audio_chunks) < 2000:  # no voice in clip
-        print('no speech in clip')
-        return None
-    cprint("transcribing ...", "green", attrs=["bold"])
-    cprint(f"You said: {transcribe(dataframes)}", 'blue', attrs=['bold'])
-    return dataframes
-
-
-# saves the audio data and performs and returns the transcription result
-# @returns: transcription text from audio data
-def transcribe(dataframes):
-    WAVE_OUTPUT_FILENAME = 'training-data/internal-transcription.wav'
-    wf = wave.open(WAVE_OUTPUT_FILENAME, 'wb')
-    wf.setnchannels(2)
-    wf.setsampwidth(pyAudio.get_sample_size(pyaudio.paInt16))
-    wf.setframerate(44100)
-    wf.writeframes(b''.join(dataframes))
-    wf.close()
-
-    audio_model = whisper.load_model('base.en')  # loading the audio model from whisper
-    result = audio_model.transcribe(WAVE_OUTPUT_FILENAME, fp16=False, language='english')
-    return result['text'].lower().strip()
-
-
-cprint('\n-----------------------ignore-above-warnings-if-any-----------------------', 'red', attrs=['bold'])
-cprint('Welcome to Master Control Mode Setup', "blue", attrs=['bold'])
-cprint('We need to record some samples of your voice', "blue", attrs=['bold'])
-
-system_name = config_manager.config['name']
-cprint(f'Current System Name: {system_name}', 'blue', attrs=["bold"])
-cprint(
-    f'Now, you will be asked to speak three times, you can speak whatever you want, e.g hey {system_name}',
-    'green', attrs=['bold'])
-cprint('Note: You are given only 3 seconds to speak!', 'red', attrs=['bold'])
-
-choice = input('Ready to speak? (y/n) default y: ')
-if choice == '':
-    choice = 'y'
-
-chances = 3  # no of samples needed
-
-# collecting voice samples ...
-while choice in 'yn':
-    if choice == 'y':
-        audio_frames = listen()
-        if audio_frames is not None:
-            chx = input('Record again or save? (y/n) default y: ')
-            if chx == '':
-                chx = 'y'
-            if chx == 'y':
-                cprint('>>> Saved!', 'green', attrs=['bold'])
-                training_data_set[chances] = audio_frames
-                chances -= 1
-        else:
-            cprint('Try Again!', 'blue', attrs=['bold'])
-    else:
-        cprint('Quitting Master Mode Setup', 'red', attrs=['bold'])
+from enrollment import LOW_QUALITY, MIN_SAMPLES, Enrollment, EnrollmentError
+
+# Records the master's voice samples for master mode, see enrollment.py
+#
+# usage (from robot/voice):
+#   python3 master_control_mode_setup.py            records samples until the set is complete
+#   python3 master_control_mode_setup.py --add 2    records two more samples
+#   python3 master_control_mode_setup.py --list     shows the samples and their quality
+#   python3 master_control_mode_setup.py --remove master_mode_audio_sample2.wav
+
+
+def ask(question):
+    choice = input(f'{question} (y/n) default y: ').strip().lower()
+    return choice in ('', 'y')
+
+
+def describe(sample, quality):
+    if quality is None:
+        cprint(f'{os.path.basename(sample)}: not scored yet', 'yellow')
+        return
+    color = 'green' if quality['score'] >= LOW_QUALITY else 'red'
+    cprint(f"{os.path.basename(sample)}: quality {quality['score']:.2f} "
+           f"(speech {quality['speech_seconds']:.1f}s, snr {quality['snr_db']:.0f}dB, "
+           f"similarity {quality['consistency']:.2f})", color)
+
+
+# records one phrase with the capture settings from config.json
+# @returns: 16 bit PCM, valid until the next recording
+def record(stream):
+    config = config_manager.config
+    return capture.record_until_silence(stream, config['chunk-size'], capture.FORMAT, config['channels'],
+                                        config['rate'], config['speech-threshold'], 0.8)
+
+
+@click.command()
+@click.option("--add", "add_count", type=int, default=None, help="Number of samples to add to the existing set")
+@click.option("--list", "list_only", is_flag=True, help="Show the samples and their quality")
+@click.option("--remove", default=None, help="Sample file to remove")
+def main(add_count, list_only, remove):
+    config_manager.init()
+
+    # Loading the speaker model takes a while, warnings it prints can be ignored
+    from master_mode_manager import SpeakerVerifier
+    enrollment = Enrollment(SpeakerVerifier())
+    samples = enrollment.store.samples()
+
+    if list_only:
+        for sample in samples:
+            describe(sample, enrollment.store.quality(sample))
+        if not samples:
+            cprint('No samples recorded yet', 'red', attrs=['bold'])
+        return
+
+    if remove:
+        enrollment.remove_sample(remove)
+        cprint(f'>>> Removed {remove}', 'green', attrs=['bold'])
+        return
+
+    needed = add_count if add_count is not None else max(0, MIN_SAMPLES - len(samples))
+    if needed == 0:
+        cprint(f'Master Mode is already set up with {len(samples)} samples, use --add to record more',
+               'blue', attrs=['bold'])
+        return
+
+    cprint('\n-----------------------ignore-above-warnings-if-any-----------------------', 'red', attrs=['bold'])
+    cprint('Welcome to Master Control Mode Setup', "blue", attrs=['bold'])
+    system_name = config_manager.config['name']
+    cprint(f'Current System Name: {system_name}', 'blue', attrs=["bold"])
+    cprint(f'You will be asked to speak {needed} times, you can speak whatever you want, e.g hey {system_name}',
+           'green', attrs=['bold'])
+    cprint('Recording stops when you stop speaking', 'green', attrs=['bold'])
+
+    pyAudio = pyaudio.PyAudio()
+    stream = capture.open_stream(pyAudio, config_manager.config)
+    try:
+        while needed > 0:
+            if not ask('Ready to speak?'):
+                cprint('Quitting Master Mode Setup', 'red', attrs=['bold'])
+                break
+            pcm = record(stream)
+            try:
+                sample, quality = enrollment.add_sample(pcm, config_manager.config['rate'],
+                                                        config_manager.config['channels'])
+            except EnrollmentError as e:
+                cprint(f'Try Again! {e}', 'blue', attrs=['bold'])
+                continue
+            describe(sample, quality)
+            if quality['score'] < LOW_QUALITY and ask('Low quality sample, record it again?'):
+                enrollment.remove_sample(sample)
+                continue
+            cprint('>>> Saved!', 'green', attrs=['bold'])
+            needed -= 1
+    finally:
         stream.close()
-    if chances == 0:
-        break
-    choice = input('Ready to speak again? (y/n) default y: ')
-    if choice == '':
-        choice = 'y'
-
-# creating master data samples ...
-if chances != 3:
-    cprint('Saving Training Data', 'blue', attrs=['bold'])
-
-    for key in training_data_set:
-        frames = b''.join(training_data_set[key])
-
-        wf = wave.open(f'training-data/master_mode_audio_sample{key}.wav', 'wb')
-        wf.setnchannels(2)
-        wf.setsampwidth(pyAudio.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(44100)
-        wf.writeframes(frames)
-        wf.close()
-
-    open('training-data/master-mode', "w").close()
-
-    cprint('Master Mode is all Set!', 'blue', attrs=['bold'])
-else:
-    cprint('No Training Data collected, restart the program to try again!', 'red', attrs=['bold'])
+        pyAudio.terminate()
+
+    if enrollment.store.is_ready():
+        cprint('Master Mode is all Set!', 'blue', attrs=['bold'])
+    else:
+        remaining = MIN_SAMPLES - len(enrollment.store.samples())
+        cprint(f'{remaining} more samples are needed, run the setup again to continue!', 'red', attrs=['bold'])
+
+
+if __name__ == '__main__':
+    main()
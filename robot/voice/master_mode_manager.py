@@ -1,20 +1,138 @@
 import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import torch
 from speechbrain.inference import SpeakerRecognition
 
+import enrollment
+import metrics
+from enrollment import normalize
+
+DEFAULT_THRESHOLD = 0.25  # same cosine threshold as SpeakerRecognition.verify_files
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+# runs the transcriptions while their speakers are being verified, the workers only
+# wait for the inference scheduler, which batches the utterances of concurrent sessions
+_asr_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='master-mode-asr')
+
 
 # @return True if master-mode configuration is ready
 def canEnableMasterMode():
-    return os.path.exists('training-data/master-mode')
-
-
-# uses speechbrain to check if the current mic fetched audio is same as the master mode sample audio
-def isMasterSpeaking():
-    verification = SpeakerRecognition.from_hparams(source="speechbrain/spkrec-ecapa-voxceleb",
-                                                   savedir="pretrained_models/spkrec-ecapa-voxceleb")
-    for i in range(1, 4):
-        score, prediction = verification.verify_files(f"training-data/master_mode_audio_sample{i}.wav",
-                                                      "misc/last-mic-fetch.wav")
-        if not not prediction[0]:
-            return True
-    return False
+    return os.path.exists(enrollment.READY_FILE)
+
+
+class SpeakerVerifier:
+    """
+    Keeps the speaker recognition model resident together with the master's
+    enrollment embeddings, so verifying a phrase is a single forward pass
+    over the live audio plus a few dot products. The embeddings come from
+    the enrollment store, which caches them as .npy files.
+    """
+
+    def __init__(self, store=None, threshold=DEFAULT_THRESHOLD):
+        self.store = store or enrollment.EnrollmentStore()
+        self.threshold = threshold
+        self.model = SpeakerRecognition.from_hparams(source="speechbrain/spkrec-ecapa-voxceleb",
+                                                     savedir="pretrained_models/spkrec-ecapa-voxceleb")
+        self.embeddings, self.centroid = [], None
+        self.reload()
+
+    def reload(self):
+        """Picks up samples added or removed since the verifier was loaded."""
+        with metrics.timer('master_mode.enrollment'):
+            self.embeddings, self.centroid = self.store.embeddings(self.embed_file)
+
+    def embed(self, waveform, sample_rate):
+        """
+        @waveform: float tensor or array in [-1, 1], shaped (time,) or (time, channels)
+        @returns: the normalized speaker embedding
+        """
+        signal = torch.as_tensor(waveform, dtype=torch.float32)
+        signal = self.model.audio_normalizer(signal, sample_rate)
+        with torch.no_grad():
+            embedding = self.model.encode_batch(signal.unsqueeze(0), normalize=False)
+        return normalize(embedding.squeeze().cpu().numpy())
+
+    def embed_pcm(self, frames, sample_rate, channels=1):
+        return self.embed(pcm_to_waveform(frames, channels), sample_rate)
+
+    def embed_file(self, filename):
+        with torch.no_grad():
+            embedding = self.model.encode_batch(self.model.load_audio(filename).unsqueeze(0), normalize=False)
+        return normalize(embedding.squeeze().cpu().numpy())
+
+    def score(self, waveform, sample_rate):
+        """@returns: the best cosine similarity to the master's samples or their centroid"""
+        if not self.embeddings:
+            return -1.0
+        with metrics.timer('master_mode.verify'):
+            live = self.embed(waveform, sample_rate)
+        references = self.embeddings + ([self.centroid] if self.centroid is not None else [])
+        return float(max(np.dot(reference, live) for reference in references))
+
+    def verify(self, waveform, sample_rate):
+        return self.score(waveform, sample_rate) >= self.threshold
+
+
+# the resident verifier, loaded on first use (or up front with get_verifier at startup)
+def get_verifier(threshold=DEFAULT_THRESHOLD):
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = SpeakerVerifier(threshold=threshold)
+        return _verifier
+
+
+# converts 16 bit PCM as recorded from the mic to float samples shaped (time, channels)
+def pcm_to_waveform(frames, channels=1):
+    samples = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+    return samples.reshape(-1, channels) if channels > 1 else samples
+
+
+# uses speechbrain to check if the mic fetched audio is the master's voice
+# @frames: 16 bit PCM bytes of the live audio, never written to disk
+def isMasterSpeaking(frames, sample_rate, channels=1):
+    return get_verifier().verify(pcm_to_waveform(frames, channels), sample_rate)
+
+
+# master-mode stage: transcribes the utterance while the speaker is verified on
+# the same in-memory audio; an unauthorized speaker cancels the transcription
+# @pcm: 16 bit PCM bytes of the utterance
+# @transcribe(cancel_event) returns the text or raises once the event is set
+# @cpu_time() measures the CPU time spent by the transcribing thread, including work offloaded for it
+# @returns: (authorized, text), text is None when the speaker was rejected
+def transcribe_if_master(transcribe, pcm, sample_rate, channels=1, cpu_time=time.thread_time):
+    cancel_event = threading.Event()
+
+    def run():
+        started = cpu_time()
+        try:
+            return transcribe(cancel_event), cpu_time() - started
+        except Exception as e:
+            e.cpu_time = cpu_time() - started
+            raise
+
+    future = _asr_executor.submit(run)
+    try:
+        authorized = isMasterSpeaking(pcm, sample_rate, channels)
+    except Exception:
+        cancel_event.set()  # no answer to wait for, the transcription stops at its next stage
+        raise
+    if authorized:
+        text, asr_cpu = future.result()
+        metrics.observe('master_mode.asr_cpu', asr_cpu)
+        return True, text
+
+    cancel_event.set()
+    try:
+        _, asr_cpu = future.result()
+    except Exception as e:
+        asr_cpu = getattr(e, 'cpu_time', 0.0)
+    metrics.increment('master_mode.rejected')
+    metrics.observe('master_mode.wasted_asr_cpu', asr_cpu)
+    return False, None
@@ -0,0 +1,83 @@
+import threading
+from bisect import bisect_left
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# In-process counters and latency samples, reported when the assistant exits
+
+MAX_SAMPLES = 1000  # latest samples kept per timing
+
+_lock = threading.Lock()
+counters = defaultdict(int)
+timings = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+histograms = dict()  # name -> (ascending upper bounds, counts with a last slot for larger values)
+
+
+def increment(name, value=1):
+    with _lock:
+        counters[name] += value
+
+
+def observe(name, seconds):
+    with _lock:
+        timings[name].append(seconds)
+
+
+def histogram(name, value, buckets):
+    """Counts @value in the first of the ascending @buckets upper bounds it does not exceed."""
+    with _lock:
+        if name not in histograms:
+            histograms[name] = (tuple(buckets), [0] * (len(buckets) + 1))
+        bounds, counts = histograms[name]
+        counts[bisect_left(bounds, value)] += 1
+
+
+@contextmanager
+def timer(name):
+    """Records how long the enclosed block took under @name."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summary():
+    """@returns: counters, count/mean/p50/p95 (in seconds) of every timing and the histogram buckets"""
+    with _lock:
+        result = {"counters": dict(counters), "timings": dict(), "histograms": dict()}
+        for name, (bounds, counts) in histograms.items():
+            buckets = {f"<={bound:g}": count for bound, count in zip(bounds, counts)}
+            buckets[f">{bounds[-1]:g}"] = counts[-1]
+            result["histograms"][name] = buckets
+        for name, samples in timings.items():
+            values = sorted(samples)
+            if not values:
+                continue
+            result["timings"][name] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": _percentile(values, 0.5),
+                "p95": _percentile(values, 0.95),
+            }
+        return result
+
+
+def report():
+    """Prints the summary to the console."""
+    data = summary()
+    if not data["counters"] and not data["timings"] and not data["histograms"]:
+        return
+    print(">>> Metrics")
+    for name, value in sorted(data["counters"].items()):
+        print(f"{name}: {value}")
+    for name, stats in sorted(data["timings"].items()):
+        print(f"{name}: n={stats['count']} mean={stats['mean'] * 1000:.1f}ms "
+              f"p50={stats['p50'] * 1000:.1f}ms p95={stats['p95'] * 1000:.1f}ms")
+    for name, buckets in sorted(data["histograms"].items()):
+        print(f"{name}: " + " ".join(f"{bucket}:{count}" for bucket, count in buckets.items() if count))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for an OpenAI-compatible /v1/chat/completions endpoint,
+# used to develop and benchmark the assistant without network or API key
+
+DEFAULT_REPLY = ("This is a reply from the local mock server. It streams tokens with a configurable delay. "
+                 "Use it to measure time to first token and time to first audio.")
+
+
+def make_handler(reply, first_token_latency, token_latency):
+    class MockCompletionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass  # keep benchmark output clean
+
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                self.send_error(400)
+                return
+
+            # Split like a tokenizer would, keeping the leading spaces
+            tokens = [word if i == 0 else " " + word for i, word in enumerate(reply.split(" "))]
+            max_tokens = request.get("max_tokens")
+            if max_tokens:
+                tokens = tokens[:max_tokens]
+
+            time.sleep(first_token_latency)
+            if request.get("stream"):
+                self._stream(tokens)
+            else:
+                self._complete("".join(tokens))
+
+        def _complete(self, text):
+            body = json.dumps({"choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]})
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self, tokens):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            # Chunked like the real services, so clients see every event as soon as it is sent
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for i, token in enumerate(tokens):
+                    if i > 0:
+                        time.sleep(token_latency)
+                    chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client cancelled the request
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return MockCompletionHandler
+
+
+# starts the mock server on a background thread
+# @returns: the server, call shutdown() on it to stop
+def start_server(port=8089, reply=DEFAULT_REPLY, first_token_latency=0.3, token_latency=0.03):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(reply, first_token_latency, token_latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock LLM server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.03, help="seconds between tokens")
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port),
+                                 make_handler(args.reply, args.first_token_latency, args.token_latency))
+    print(f"Mock LLM server listening on http://127.0.0.1:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,125 @@
+import socket
+import sys
+import threading
+
+# Hosts probed with a plain TCP connect, the network is up if any of them answers
+DEFAULT_HOSTS = ["translate.google.com:443", "api.mistral.ai:443", "1.1.1.1:53"]
+
+
+def _parse_host(host):
+    name, _, port = host.rpartition(":")
+    if not name:
+        return host, 443
+    return name, int(port)
+
+
+class NetworkMonitor:
+    """
+    Watches connectivity on a background thread and tells subscribers when
+    it changes. While online the hosts are probed every @interval seconds;
+    while offline the probe backs off exponentially from @min_backoff up to
+    @max_backoff, so a flaky link is noticed quickly without hammering it.
+    """
+
+    def __init__(self, hosts=None, interval=30.0, min_backoff=2.0, max_backoff=300.0, timeout=2.0):
+        self.hosts = [_parse_host(host) for host in (hosts or DEFAULT_HOSTS)]
+        self.interval = interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        # Optimistic until the first probe: the backends fall back on their own if it is wrong
+        self._online = True
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def online(self):
+        return self._online
+
+    def subscribe(self, callback):
+        """
+        Calls @callback(online) on every state change, from the monitor thread.
+        @returns: the current state
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+            return self._online
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def probe(self):
+        """@returns: True if any host accepts a TCP connection"""
+        for host, port in self.hosts:
+            try:
+                with socket.create_connection((host, port), timeout=self.timeout):
+                    return True
+            except OSError:
+                continue
+        return False
+
+    def recheck(self):
+        """Probes again right away, e.g. after a request failed to connect."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _publish(self, online):
+        with self._lock:
+            if online == self._online:
+                return
+            self._online = online
+            subscribers = list(self._subscribers)
+        print(f"📢 Network {'connected' if online else 'unreachable'}", file=sys.stderr)
+        for callback in subscribers:
+            try:
+                callback(online)
+            except Exception as e:
+                print(f"📢 network subscriber failed: {e}", file=sys.stderr)
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stopped.is_set():
+            online = self.probe()
+            self._publish(online)
+            if online:
+                backoff = self.min_backoff
+                delay = self.interval
+            else:
+                delay = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+
+# Shared monitor, configured and started by init()
+monitor = NetworkMonitor()
+
+
+# starts probing in the background with the settings from config.json
+def init(config):
+    monitor.hosts = [_parse_host(host) for host in config.get('network-check-hosts', DEFAULT_HOSTS)]
+    monitor.interval = config.get('network-check-interval', 30)
+    monitor.max_backoff = config.get('network-check-max-backoff', 300)
+    monitor.start()
+
+
+def is_online():
+    return monitor.online
+
+
+def subscribe(callback):
+    return monitor.subscribe(callback)
@@ -1,14 +1,120 @@
 import os
 import subprocess
+import sys
+import threading
+import time
+from collections import deque
 
 import config_manager
 
+try:
+    import dbus
+except ImportError:
+    dbus = None  # falls back to notify-send
+
 username = os.environ.get("USERNAME")
 
+APP_NAME = "Linux Voice Control"
+ICON = f'/home/{username}/lvc-bin/lvc-icon.png'
+
+COALESCE_WINDOW = 0.2  # seconds to wait for more notifications of a burst
+STALE_AFTER = 5.0  # seconds after which a notification not shown yet is dropped
+MAX_LINES = 3  # messages shown in one coalesced notification
+
+
+class NotificationService:
+    """
+    Shows desktop notifications from a background worker, so callers only
+    enqueue. Notifications arriving in a burst are merged into one (each
+    message once), those that waited too long are dropped, and each one
+    replaces the previous one instead of stacking up. Talks to the notification daemon over
+    D-Bus when dbus-python is available, otherwise runs notify-send.
+    """
+
+    def __init__(self):
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._interface = None
+        self._last_id = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def notify(self, message, duration=0):
+        with self._condition:
+            self._pending.append((time.monotonic(), message, duration))
+            self._condition.notify()
+
+    def _take_burst(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+        time.sleep(COALESCE_WINDOW)
+        with self._condition:
+            burst = list(self._pending)
+            self._pending.clear()
+        now = time.monotonic()
+        return [item for item in burst if now - item[0] <= STALE_AFTER]
+
+    def _run(self):
+        while True:
+            burst = self._take_burst()
+            if not burst:
+                continue
+            messages = list(dict.fromkeys(message for _, message, _ in burst))[-MAX_LINES:]
+            body = "\n".join(messages)
+            # 0 never expires, so it outlasts any finite timeout of the burst
+            durations = [duration for _, _, duration in burst]
+            duration = 0 if 0 in durations else max(durations)
+            try:
+                self._show(body, duration)
+            except Exception as e:
+                print(f"📢 notification failed: {e}", file=sys.stderr)
+
+    def _dbus_interface(self):
+        if self._interface is None and dbus is not None:
+            try:
+                proxy = dbus.SessionBus().get_object('org.freedesktop.Notifications',
+                                                     '/org/freedesktop/Notifications')
+                self._interface = dbus.Interface(proxy, 'org.freedesktop.Notifications')
+            except dbus.DBusException:
+                self._interface = None
+        return self._interface
+
+    def _show(self, body, duration):
+        interface = self._dbus_interface()
+        if interface is not None:
+            try:
+                self._last_id = int(interface.Notify(APP_NAME, self._last_id, ICON, APP_NAME, body, [],
+                                                     {'transient': dbus.Boolean(True)}, duration))
+                return
+            except dbus.DBusException:
+                self._interface = None  # daemon restarted, reconnect next time
+        process = subprocess.Popen(
+            ['notify-send', f'--icon={ICON}', f'--app-name="{APP_NAME}"', f'--expire-time={duration}',
+             "--transient", APP_NAME, body],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = NotificationService()
+        return _service
+
 
-# Sends a Desktop Notification using notify-send command
+# Queues a Desktop Notification, shown by the notification service without blocking the caller
 def notify(message, duration=0, force=False):
     if not force and not config_manager.config['notifications-enabled']:
         return
-    subprocess.call(
-        ['notify-send', f'--icon=/home/{username}/lvc-bin/lvc-icon.png', '--app-name=\"Linux Voice Control\"', f'--expire-time={duration}', "--transient", "Linux Voice Control", message])
+    get_service().notify(message, duration)
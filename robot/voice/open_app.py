@@ -3,7 +3,6 @@
 import sys
 import subprocess
 import os
-import whisper
 from termcolor import cprint
 from thefuzz import process
 from voice_feedback import speak  # Import the speak function
@@ -12,9 +11,6 @@ import config_manager
 # Initialize config_manager
 config_manager.init()
 
-# Load the Whisper model (do this once at the beginning of the script)
-audio_model = whisper.load_model("base")
-
 # Log function
 def log(message, color="white"):
     colors = {
@@ -0,0 +1,94 @@
+from termcolor import cprint
+
+import audio_output
+import basic_mode_manager
+import config_manager
+import master_mode_manager
+import transcript_gate
+import transcription
+import voice_feedback
+
+# Turns recorded segments into text, shared by the assistant and the assistant daemon
+
+
+def log(text, color=None, attrs=None):
+    if attrs is None:
+        attrs = []
+    if color is None:
+        print(text)
+    elif config_manager.config['logs']:
+        cprint(text, color, attrs=attrs)
+
+
+def transcribe_hot_word(audio_model, pcm, rate, channels):
+    """
+    Transcribes a hot word candidate in memory.
+    :return: The lower case text with letters, digits and spaces only.
+    """
+    text = transcription.transcribe(audio_model, transcription.pcm_to_audio(pcm, rate, channels))
+    text = text.lower().strip()
+    return "".join([ch for ch in text if ch.isalpha() or ch.isdigit() or ch == ' '])
+
+
+def transcribe_command(audio_model, pcm, rate, channels):
+    """
+    Transcribes the command audio in memory. In master mode the speaker is
+    verified at the same time, and the transcription of anyone else is
+    cancelled and answered with the barrier speech. Transcripts of silence
+    or noise are dropped by the transcript gate.
+    :return: The transcribed text, empty if the speaker or the transcript was rejected.
+    """
+    def run(cancel_event=None):
+        audio = transcription.pcm_to_audio(pcm, rate, channels)
+        result = transcription.decode(audio_model, audio, cancel_event)
+        reason = transcript_gate.check(result)
+        if reason is not None:
+            log(f'Dropped transcript "{result.text.strip()}" ({reason}).', "yellow")
+            return ''
+        return result.text
+
+    if not config_manager.config['master-mode']:
+        return run().lower().strip()
+
+    authorized, text = master_mode_manager.transcribe_if_master(run, pcm, rate, channels,
+                                                                cpu_time=transcription.cpu_time)
+    if not authorized:
+        _reject_speaker()
+        return ''
+    return text.lower().strip()
+
+
+def transcribe_wake_and_command(audio_model, pcm, rate, channels):
+    """
+    Transcribes a hot word segment, extended with the command when the
+    speaker went on after the wake phrase, in a single Whisper pass. The
+    command is checked as transcribe_command does: by the transcript gate
+    and, in master mode, by the speaker verification.
+    :return: (woke, command): whether the segment starts with a wake phrase
+             that was accepted, and the lower case command said after it,
+             empty if there is none.
+    """
+    result = transcription.decode(audio_model, transcription.pcm_to_audio(pcm, rate, channels))
+    command = basic_mode_manager.strip_wake_phrase(result.text)
+    if not command:
+        return command is not None, ''
+
+    reason = transcript_gate.check(result, command)
+    if reason is not None:
+        log(f'Dropped transcript "{result.text.strip()}" ({reason}).', "yellow")
+        # a hallucinated tail ("hey computer. thank you.") still leaves the hot word
+        return reason == "blocklist", ''
+    if config_manager.config['master-mode']:
+        # already transcribed, only the speaker is left to verify
+        authorized, _ = master_mode_manager.transcribe_if_master(lambda cancel_event: command, pcm, rate, channels,
+                                                                 cpu_time=transcription.cpu_time)
+        if not authorized:
+            _reject_speaker()
+            return False, ''
+    return True, command.lower().strip()
+
+
+def _reject_speaker():
+    log('Unauthorized speaker, command ignored.', "red", attrs=['bold'])
+    if config_manager.config['master-mode-barrier-speech-enabled']:
+        voice_feedback.speak(config_manager.config['master-mode-barrier-speech'], priority=audio_output.URGENT)
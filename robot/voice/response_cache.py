@@ -0,0 +1,58 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+    """Lowercases the prompt and drops punctuation and repeated spaces."""
+    text = re.sub(r"[^\w\s]", " ", prompt.lower())
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache of AI answers keyed on the normalized prompt and
+    response style. Entries expire after @ttl seconds, and prompts containing
+    one of the @opt_out phrases (e.g. "time", "today") are never cached.
+    The audio of a cached answer is reused through the voice feedback cache.
+    """
+
+    def __init__(self, max_size, ttl, opt_out=()):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.opt_out = [normalize_prompt(phrase) for phrase in opt_out]
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_cacheable(self, prompt):
+        text = f" {normalize_prompt(prompt)} "
+        return not any(f" {phrase} " in text for phrase in self.opt_out)
+
+    @staticmethod
+    def _key(prompt, style):
+        return f"{style}:{normalize_prompt(prompt)}"
+
+    def get(self, prompt, style):
+        """Returns the cached answer if it is still fresh, or None."""
+        key = self._key(prompt, style)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            response, expires = entry
+            if time.time() > expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return response
+
+    def put(self, prompt, style, response):
+        if not self.is_cacheable(prompt):
+            return
+        key = self._key(prompt, style)
+        with self._lock:
+            self.entries[key] = (response, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
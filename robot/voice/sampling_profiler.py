@@ -0,0 +1,168 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Statistical profiler for the live assistant (main.py --profile): a SIGPROF timer
+# samples the Python stacks of every thread, and every N utterances the samples
+# are written as collapsed stacks (flamegraph.pl, speedscope) and as a speedscope
+# profile. Sampling costs one stack walk per interval, so it can stay on in
+# production for a while.
+
+PROFILES_DIR = 'profiles'
+STAGES = ('capture', 'asr', 'dispatch', 'tts', 'ai')
+
+_profiler = None  # the running profiler, if any
+_no_stage = nullcontext()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every @interval seconds of process CPU
+    time. With a @target stage, only threads inside that stage (see stage())
+    are sampled. Signals are handled on the main thread between bytecodes,
+    so a sample due while it blocks in C code is taken once it resumes.
+    """
+
+    def __init__(self, interval=0.005, every=10, target=None, directory=PROFILES_DIR):
+        self.interval = interval
+        self.every = every
+        self.target = target
+        self.directory = directory
+        self._counts = defaultdict(int)
+        self._stages = dict()  # thread id -> innermost stage
+        self._utterances = 0
+        self._flushes = 0
+        self._started = None
+        self._main_thread = threading.main_thread().ident
+
+    def start(self):
+        global _profiler
+        _profiler = self
+        self._started = time.strftime('%Y%m%d-%H%M%S')
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        global _profiler
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        _profiler = None
+        self.flush()
+
+    def _sample(self, signum, frame):
+        stages = self._stages
+        for thread_id, thread_frame in sys._current_frames().items():
+            stage = stages.get(thread_id)
+            if self.target is not None and stage != self.target:
+                continue
+            if thread_id == self._main_thread:
+                thread_frame = frame  # skips this handler
+            stack = []
+            while thread_frame is not None:
+                code = thread_frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                thread_frame = thread_frame.f_back
+            if stage is not None:
+                stack.append((f'[{stage}]', '', 0))
+            stack.reverse()
+            self._counts[tuple(stack)] += 1
+
+    @contextmanager
+    def in_stage(self, name):
+        thread_id = threading.get_ident()
+        previous = self._stages.get(thread_id)
+        self._stages[thread_id] = name
+        try:
+            yield
+        finally:
+            if previous is None:
+                self._stages.pop(thread_id, None)
+            else:
+                self._stages[thread_id] = previous
+
+    def utterance_done(self):
+        self._utterances += 1
+        if self._utterances % self.every == 0:
+            self.flush()
+
+    def flush(self):
+        """Writes the samples taken since the last flush, if any."""
+        counts, self._counts = self._counts, defaultdict(int)
+        if not counts:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._flushes += 1
+        name = f'profile-{self._started}-{self._flushes:03d}-{self._utterances}utt'
+        if self.target is not None:
+            name += f'-{self.target}'
+        path = os.path.join(self.directory, name)
+        with open(path + '.collapsed', 'w') as file:
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                file.write(';'.join(function for function, _, _ in stack) + f' {count}\n')
+        with open(path + '.speedscope.json', 'w') as file:
+            json.dump(self._speedscope(name, counts), file)
+        print(f'📈 profile written to {path}.collapsed', file=sys.stderr)
+
+    def _speedscope(self, name, counts):
+        frames = []
+        indices = dict()
+        samples = []
+        weights = []
+        for stack, count in counts.items():
+            sample = []
+            for function, filename, line in stack:
+                key = (function, filename, line)
+                if key not in indices:
+                    indices[key] = len(frames)
+                    frames.append({'name': function, 'file': filename, 'line': line} if filename
+                                  else {'name': function})
+                sample.append(indices[key])
+            samples.append(sample)
+            weights.append(count * self.interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'linux-voice-control sampling_profiler',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+
+# marks the enclosed code as @name for the running profiler, nothing when not profiling
+def stage(name):
+    profiler = _profiler
+    if profiler is None:
+        return _no_stage
+    return profiler.in_stage(name)
+
+
+# decorator running the whole function as stage @name
+def profiled(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# counts an utterance handled by the listening loop, flushing the samples every N of them
+def utterance_done():
+    profiler = _profiler
+    if profiler is not None:
+        profiler.utterance_done()
@@ -0,0 +1,86 @@
+import queue
+import re
+import threading
+
+import voice_feedback
+from audio_output import ANSWER
+
+# A sentence ends with . ! or ? followed by whitespace; waiting for the whitespace
+# keeps "3.14" or "e.g." from being cut while tokens are still streaming in
+_sentence_end = re.compile(r"(?<=[.!?])\s+")
+
+
+class SentenceSplitter:
+    """Accumulates streamed text and hands out complete sentences."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """Adds @text and returns the sentences it completed."""
+        self.buffer += text
+        parts = _sentence_end.split(self.buffer)
+        self.buffer = parts.pop()
+        return [part.strip() for part in parts if part.strip()]
+
+    def flush(self):
+        """Returns whatever is left once the stream has ended."""
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return rest
+
+
+class SpeechPipeline:
+    """
+    Speaks sentences as soon as they are complete: a thread synthesizes
+    each sentence while later tokens are still arriving and queues the
+    clips, in order, on the voice feedback player with answer priority, so
+    acknowledgements can cut in. Clips stay in memory unless the voice
+    feedback cache keeps them, so repeated sentences are not synthesized again.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._sentences = queue.Queue()
+        self._last_job = None
+        # A daemon session collects the speech on its own thread instead of playing it
+        self._inline = voice_feedback.capturing_speech()
+        self._synthesizer = threading.Thread(target=self._synthesize_loop, daemon=True)
+        if not self._inline:
+            self._synthesizer.start()
+
+    def say(self, sentence):
+        if self._inline:
+            if not self._cancelled.is_set():
+                voice_feedback.speak(sentence)
+            return
+        self._sentences.put(sentence)
+
+    def close(self, wait=True):
+        """Signals that no more sentences follow, optionally waiting until all are spoken."""
+        if self._inline:
+            return
+        self._sentences.put(None)
+        if wait:
+            self._synthesizer.join()
+            if self._last_job is not None:
+                self._last_job.wait()
+
+    def cancel(self):
+        """Drops every sentence not spoken yet and stops the one playing."""
+        self._cancelled.set()
+        self._sentences.put(None)
+        voice_feedback.cancel_speech(self)
+
+    def _synthesize_loop(self):
+        while True:
+            sentence = self._sentences.get()
+            if sentence is None:
+                return
+            if self._cancelled.is_set():
+                continue
+            clip = voice_feedback.synthesize(sentence)
+            if clip is not None and not self._cancelled.is_set():
+                self._last_job = voice_feedback.play_clip(clip, priority=ANSWER, group=self) or self._last_job
+                if self._cancelled.is_set():
+                    voice_feedback.cancel_speech(self)  # cancelled while it was being queued
@@ -4,6 +4,8 @@ import sys
 import os
 from dotenv import load_dotenv
 
+from track_cache import TrackCache
+
 load_dotenv()
 
 # Your Spotify Developer credentials
@@ -18,6 +20,9 @@ sp = spotipy.Spotify(auth_manager=SpotifyOAuth(client_id=SPOTIPY_CLIENT_ID,
                                                redirect_uri=SPOTIPY_REDIRECT_URI,
                                                scope=scope))
 
+# Remembers which track each spoken song name resolved to
+track_cache = TrackCache()
+
 def check_active_device():
     """Checks if there is an active device and returns the device ID."""
     devices = sp.devices()
@@ -32,11 +37,23 @@ def play_song(song_name):
     if not device_id:
         return False
 
+    # Repeated requests skip the search call entirely
+    track_uri = track_cache.get(song_name)
+    if track_uri:
+        try:
+            sp.start_playback(device_id=device_id, uris=[track_uri])
+            print(f"Playing: {song_name}")
+            return True
+        except spotipy.exceptions.SpotifyException as e:
+            print(f"Cached track failed, searching again: {e}")
+            track_cache.discard(track_uri)
+
     results = sp.search(q=song_name, type='track', limit=1)
     if results['tracks']['items']:
         track_uri = results['tracks']['items'][0]['uri']
         try:
             sp.start_playback(device_id=device_id, uris=[track_uri])
+            track_cache.put(song_name, track_uri)
             print(f"Playing: {song_name}")
             return True
         except spotipy.exceptions.SpotifyException as e:
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+import command_manager
+import config_manager
+
+
+@pytest.fixture(autouse=True)
+def commands(monkeypatch):
+    # commands.json, config.json and paraphrases.json are read from the working directory
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    config_manager.init()
+    config_manager.config['show-commands-on-startup'] = False
+    command_manager.init()
+
+
+def test_weather_paraphrase_is_answered_in_process():
+    assert command_manager.decide("climate conditions").route == "weather"
+    assert command_manager.decide("what's the weather").route == "weather"
+
+
+def test_spotify_paraphrase_is_answered_in_process():
+    decision = command_manager.decide("skip this song")
+    assert decision.route == "spotify"
+    assert decision.slots["operation"] == "next"
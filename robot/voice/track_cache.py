@@ -0,0 +1,115 @@
+import atexit
+import json
+import os
+import re
+from collections import OrderedDict
+
+from thefuzz import fuzz
+from thefuzz import process
+
+# Persistent cache mapping spoken song names to Spotify track URIs
+TRACK_CACHE_FILE = "track_cache.json"
+TRACK_CACHE_SIZE = 500  # Maximum number of cached songs
+FUZZY_THRESHOLD = 90  # Minimum similarity for a fuzzy cache hit
+
+# Spoken fillers that don't change which track the user wants
+_FILLER_PREFIXES = ("the song ", "song ", "the track ", "track ")
+
+
+def normalize(song_name):
+    """
+    Normalizes a spoken song name so that small ASR variations
+    ("Bohemian Rhapsody.", "song bohemian  rhapsody") share one key.
+    """
+    text = song_name.lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = " ".join(text.split())
+    for prefix in _FILLER_PREFIXES:
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+            break
+    return text
+
+
+class TrackCache:
+    """
+    Size-bounded LRU cache of song name -> track URI, persisted as JSON.
+    The least recently used entry is the first one in the file. Changes
+    are written at once, the recency of hits only on the next change or
+    at exit.
+    """
+
+    def __init__(self, filename=TRACK_CACHE_FILE, max_size=TRACK_CACHE_SIZE, threshold=FUZZY_THRESHOLD):
+        self.filename = filename
+        self.max_size = max_size
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self._dirty = False  # hits reordered the entries since the last save
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r", encoding="utf-8") as file:
+                for key, uri in json.load(file):
+                    self.entries[key] = uri
+        except (OSError, ValueError, TypeError) as e:
+            # A broken cache is only a missed optimization, start over
+            print(f"Ignoring unreadable track cache: {e}")
+            self.entries.clear()
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a half-written cache
+        tmp_filename = self.filename + ".tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as file:
+                json.dump(list(self.entries.items()), file, ensure_ascii=False)
+            os.replace(tmp_filename, self.filename)
+            self._dirty = False
+        except OSError as e:
+            print(f"Unable to save track cache: {e}")
+
+    def get(self, song_name):
+        """
+        Returns the cached track URI for the song, or None.
+        Falls back to a fuzzy lookup when there is no exact match.
+        """
+        key = normalize(song_name)
+        if not key:
+            return None
+        if key not in self.entries:
+            if not self.entries:
+                return None
+            match = process.extractOne(key, list(self.entries.keys()),
+                                       scorer=fuzz.ratio, score_cutoff=self.threshold)
+            if match is None:
+                return None
+            key = match[0]
+        self.entries.move_to_end(key)
+        self._dirty = True
+        return self.entries[key]
+
+    def flush(self):
+        """Saves the order of the entries if hits changed it."""
+        if self._dirty:
+            self._save()
+
+    def put(self, song_name, track_uri):
+        key = normalize(song_name)
+        if not key:
+            return
+        self.entries[key] = track_uri
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        self._save()
+
+    def discard(self, track_uri):
+        """Drops every entry pointing to a track that can no longer be played."""
+        stale = [key for key, uri in self.entries.items() if uri == track_uri]
+        for key in stale:
+            del self.entries[key]
+        if stale:
+            self._save()
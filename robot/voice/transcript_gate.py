@@ -0,0 +1,67 @@
+import re
+
+import config_manager
+import metrics
+
+# Drops what Whisper hears in silence and noise ("thank you.", "you") before it is
+# dispatched, and ends up answered by the AI. Whisper's own fallback thresholds
+# are the defaults.
+
+_blocklist = None  # normalized "transcript-blocklist", built on first use
+_blocklist_source = None
+
+
+# lower case words without punctuation, as the blocklist is compared
+def normalize(text):
+    return re.sub(r'[^a-z0-9\']+', ' ', text.lower()).strip()
+
+
+def get_blocklist():
+    global _blocklist, _blocklist_source
+    phrases = config_manager.config.get('transcript-blocklist', [])
+    if _blocklist is None or _blocklist_source is not phrases:
+        _blocklist = {normalize(phrase) for phrase in phrases}
+        _blocklist_source = phrases
+    return _blocklist
+
+
+def rejection(result, text=None):
+    """
+    Checks a Whisper decoding result (text, no_speech_prob, avg_logprob,
+    compression_ratio) against the configured thresholds and blocklist.
+    @text: the part of the transcript compared with the blocklist, all of it by default
+    @returns: why the transcript is rejected ("no-speech", "low-confidence",
+    "repetitive" or "blocklist"), None if it is kept
+    """
+    config = config_manager.config
+    text = normalize(result.text if text is None else text)
+    if not text:
+        return None
+    logprob_threshold = config.get('transcript-logprob-threshold', -1.0)
+    # silence: Whisper is confident nothing was said and unsure of what it wrote
+    if (result.no_speech_prob > config.get('transcript-no-speech-threshold', 0.6)
+            and result.avg_logprob < logprob_threshold):
+        return "no-speech"
+    if result.avg_logprob < config.get('transcript-min-logprob', -1.5):
+        return "low-confidence"
+    # looping output ("the the the ...") compresses far better than speech
+    if result.compression_ratio > config.get('transcript-compression-threshold', 2.4):
+        return "repetitive"
+    if text in get_blocklist():
+        return "blocklist"
+    return None
+
+
+def check(result, text=None):
+    """
+    Gates a transcript before dispatch, counting the rejected ones in the
+    metrics (asr.rejected and asr.rejected.<reason>), see rejection().
+    @returns: the rejection reason, None if the transcript may be dispatched
+    """
+    if not config_manager.config.get('transcript-gate-enabled', True):
+        return None
+    reason = rejection(result, text)
+    if reason is not None:
+        metrics.increment('asr.rejected')
+        metrics.increment(f'asr.rejected.{reason}')
+    return reason
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import numpy as np
+import whisper
+
+import config_manager
+from inference_scheduler import InferenceScheduler, TranscriptionCancelled
+
+# Whisper works on 16 kHz mono audio
+WHISPER_RATE = whisper.audio.SAMPLE_RATE
+
+
+_schedulers = dict()
+_schedulers_lock = threading.Lock()
+
+# inference CPU time the scheduler spent on behalf of each calling thread
+_offloaded = threading.local()
+
+
+# converts 16 bit PCM bytes as recorded from the mic to 16 kHz mono float samples
+def pcm_to_audio(frames, rate, channels=1):
+    samples = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    if rate == WHISPER_RATE:
+        return samples
+    if rate % WHISPER_RATE == 0:
+        # Integer ratio (48 kHz): averaging each group doubles as a low-pass filter
+        factor = rate // WHISPER_RATE
+        return samples[:len(samples) - len(samples) % factor].reshape(-1, factor).mean(axis=1)
+    positions = np.arange(0, len(samples), rate / WHISPER_RATE)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def _check(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise TranscriptionCancelled()
+
+
+# the batching scheduler every transcription of @model goes through
+def get_scheduler(model):
+    with _schedulers_lock:
+        scheduler = _schedulers.get(id(model))
+        if scheduler is None:
+            scheduler = InferenceScheduler(model, config_manager.config.get('asr-batch-size', 8),
+                                           config_manager.config.get('asr-batch-max-wait', 0.01))
+            _schedulers[id(model)] = scheduler
+        return scheduler
+
+
+# CPU time of the calling thread, including the batched inference run for it
+def cpu_time():
+    return time.thread_time() + getattr(_offloaded, 'seconds', 0.0)
+
+
+def decode(model, audio, cancel_event=None, language='en'):
+    """
+    Transcribes in-memory audio, batched with the utterances of other
+    sessions by the inference scheduler, with whisper.transcribe's
+    temperature fallback; audio longer than 30 seconds is chunked by
+    whisper.transcribe itself. Once @cancel_event is set the utterance is
+    dropped before its next stage, so a rejected one stops using the CPU
+    early.
+    @returns: Whisper's DecodingResult or a Transcript, the text with its
+    confidence (avg_logprob, no_speech_prob, compression_ratio)
+    """
+    _check(cancel_event)
+    job = get_scheduler(model).submit(audio, cancel_event, language)
+    try:
+        result = job.future.result()
+    finally:
+        _offloaded.seconds = getattr(_offloaded, 'seconds', 0.0) + job.cpu_time
+    _check(cancel_event)
+    return result
+
+
+# @returns: the transcribed text, see decode()
+def transcribe(model, audio, cancel_event=None, language='en'):
+    return decode(model, audio, cancel_event, language).text
@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import time
+from abc import ABC, abstractmethod
+
+from gtts import gTTS, gTTSError
+
+import metrics
+
+CHUNK_SIZE = 4096
+
+
+class SynthesisError(Exception):
+    """Raised by a backend when the speech could not be synthesized."""
+
+
+class SynthesisBackend(ABC):
+    """
+    Turns text into audio bytes. Subclasses set @name (also part of the
+    cache key, since every backend sounds different) and @extension.
+    """
+    name = None
+    extension = None
+    last_error = None  # error of the latest failed synthesis
+
+    def available(self):
+        return True
+
+    @abstractmethod
+    def stream(self, text, lang):
+        """Yields the audio in chunks as it is produced, raises SynthesisError on failure."""
+
+
+class GTTSBackend(SynthesisBackend):
+    name = "gtts"
+    extension = ".mp3"
+
+    def stream(self, text, lang):
+        # gTTS fetches the text part by part, each part is yielded as soon as it arrives
+        try:
+            yield from gTTS(text=text, lang=lang, slow=False).stream()
+        except gTTSError as e:
+            raise SynthesisError(e)
+
+
+def _stream_process(args, input_data=None):
+    """Runs a local engine and yields its stdout while it is being written."""
+    process = subprocess.Popen(args, stdin=subprocess.PIPE if input_data else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        if input_data:
+            process.stdin.write(input_data)
+            process.stdin.close()
+        while True:
+            chunk = process.stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        if process.wait() != 0:
+            raise SynthesisError(f"{args[0]} failed: {process.stderr.read().decode('utf-8', 'replace')}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+class EspeakBackend(SynthesisBackend):
+    """espeak-ng (or espeak) through its command line, no network needed."""
+    name = "espeak-ng"
+    extension = ".wav"
+
+    def __init__(self):
+        self.binary = shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def available(self):
+        return self.binary is not None
+
+    def stream(self, text, lang):
+        return _stream_process([self.binary, "-v", lang, "--stdout", text])
+
+
+class PiperBackend(SynthesisBackend):
+    """
+    piper neural TTS through its command line. piper streams raw PCM, which
+    is given a WAV header here so that players can identify it.
+    """
+    name = "piper"
+    extension = ".wav"
+
+    def __init__(self, model):
+        self.binary = shutil.which("piper")
+        self.model = model
+
+    def available(self):
+        return self.binary is not None and bool(self.model) and os.path.exists(self.model)
+
+    def _sample_rate(self):
+        try:
+            with open(self.model + ".json", "r", encoding="utf-8") as file:
+                return json.load(file)["audio"]["sample_rate"]
+        except (OSError, ValueError, KeyError):
+            return 22050
+
+    def stream(self, text, lang):
+        rate = self._sample_rate()
+        # 16 bit mono, sizes left at their maximum since the length is unknown
+        yield b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVEfmt " \
+            + struct.pack("<IHHIIHH", 16, 1, 1, rate, rate * 2, 2, 16) \
+            + b"data" + struct.pack("<I", 0xFFFFFFFF)
+        yield from _stream_process([self.binary, "--model", self.model, "--output-raw"], text.encode("utf-8"))
+
+
+def create_local_backend(name, piper_model=None):
+    """@returns: the configured local backend, or None if it is disabled or not installed"""
+    if name == "espeak-ng":
+        backend = EspeakBackend()
+    elif name == "piper":
+        backend = PiperBackend(piper_model)
+    else:
+        return None
+    return backend if backend.available() else None
+
+
+class SynthesisRouter:
+    """
+    Picks the backends to try for a phrase: the local engine for short
+    acknowledgements (or whenever the network is down), the cloud one for
+    long-form answers, each falling back to the other.
+    """
+
+    def __init__(self, cloud, local=None, local_max_chars=40):
+        self.cloud = cloud
+        self.local = local
+        self.local_max_chars = local_max_chars
+
+    def route(self, text, online=True):
+        if self.local is None:
+            return [self.cloud]
+        if not online or len(text) <= self.local_max_chars:
+            return [self.local, self.cloud]
+        return [self.cloud, self.local]
+
+    def stream(self, text, lang, online=True):
+        """
+        Starts the first routed backend that produces audio; a backend failing
+        before its first chunk falls back to the next one.
+        @returns: (backend, chunks) or (None, None) if every backend failed
+        """
+        for backend in self.route(text, online):
+            started = time.perf_counter()
+            chunks = backend.stream(text, lang)
+            try:
+                first = next(chunks)
+            except (SynthesisError, StopIteration) as e:
+                backend.last_error = e
+                print(f"📢 {backend.name} synthesis failed: {e}", file=sys.stderr)
+                metrics.increment(f"tts.{backend.name}.failures")
+                continue
+            backend.last_error = None
+            metrics.observe(f"tts.{backend.name}.first_chunk", time.perf_counter() - started)
+            return backend, self._timed(backend, started, first, chunks)
+        return None, None
+
+    @staticmethod
+    def _timed(backend, started, first, chunks):
+        yield first
+        yield from chunks
+        metrics.observe(f"tts.{backend.name}.latency", time.perf_counter() - started)
+
+    def synthesize(self, text, lang, online=True):
+        """
+        Synthesizes the whole phrase in memory.
+        @returns: (backend, audio bytes) or (None, None) if every backend failed
+        """
+        backend, chunks = self.stream(text, lang, online)
+        if backend is None:
+            return None, None
+        try:
+            return backend, b"".join(chunks)
+        except SynthesisError as e:
+            backend.last_error = e
+            print(f"📢 {backend.name} synthesis failed: {e}", file=sys.stderr)
+            metrics.increment(f"tts.{backend.name}.failures")
+            return None, None
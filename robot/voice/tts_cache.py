@@ -0,0 +1,114 @@
+import hashlib
+import os
+import threading
+import time
+
+# Synthesized speech, one file per (text, language, speed, voice) named after its hash
+TTS_CACHE_DIR = "misc/tts-cache"
+TTS_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+
+def cache_key(text, lang, speed, voice):
+    """Content address of a synthesized phrase, @voice is the synthesis backend."""
+    return hashlib.sha1(f"{voice}|{lang}|{speed}|{text.strip()}".encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Size-bounded LRU cache of synthesized speech on disk. The files themselves
+    are the index: their modification time is bumped on every hit, so the
+    least recently used ones are evicted first, also across restarts.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files = dict()  # key -> (file name, size)
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            key, extension = os.path.splitext(name)
+            if extension == ".tmp":
+                continue
+            size = os.path.getsize(os.path.join(directory, name))
+            self._files[key] = (name, size)
+            self._total += size
+
+    def get(self, text, lang, speed, voice):
+        """Returns the path of the cached clip, or None."""
+        key = cache_key(text, lang, speed, voice)
+        with self._lock:
+            if key not in self._files:
+                return None
+            path = os.path.join(self.directory, self._files[key][0])
+            try:
+                os.utime(path)
+            except OSError:
+                # Removed behind our back
+                self._total -= self._files.pop(key)[1]
+                return None
+            return path
+
+    def put(self, text, lang, speed, voice, data, extension):
+        """Stores the synthesized audio @data and returns the path of the cached clip."""
+        key = cache_key(text, lang, speed, voice)
+        name = key + extension
+        path = os.path.join(self.directory, name)
+        # Written aside and renamed, so a clip is either complete or not there at all
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        with self._lock:
+            os.replace(tmp_path, path)
+            if key in self._files:
+                self._total -= self._files[key][1]
+            self._files[key] = (name, len(data))
+            self._total += len(data)
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep):
+        if self._total <= self.max_bytes:
+            return
+        entries = []
+        for key, (name, _) in self._files.items():
+            try:
+                entries.append((os.path.getmtime(os.path.join(self.directory, name)), key))
+            except OSError:
+                entries.append((0, key))
+        for _, key in sorted(entries):
+            if self._total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            name, size = self._files.pop(key)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            self._total -= size
+
+    def warm_up(self, phrases, lang, speed, synthesize):
+        """
+        Synthesizes every phrase not cached yet on a background thread.
+        @synthesize(text) must return (voice, audio bytes, extension), or
+        (None, None, None) on failure.
+        """
+        def run():
+            started = time.time()
+            count = 0
+            for text, voices in phrases:
+                if not text or any(self.get(text, lang, speed, voice) is not None for voice in voices):
+                    continue
+                voice, data, extension = synthesize(text)
+                if voice is None:
+                    break  # most likely offline, try again next start
+                self.put(text, lang, speed, voice, data, extension)
+                count += 1
+            if count:
+                print(f"📢 Pre-synthesized {count} phrases in {time.time() - started:.1f}s")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
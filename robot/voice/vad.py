@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None  # falls back to the energy detector
+
+FRAME_MS = 30  # frame length accepted by webrtcvad (10, 20 or 30 ms)
+WEBRTC_RATES = (8000, 16000, 32000, 48000)
+MIN_ENERGY_DB = -45.0  # quietest frame the energy detector counts as speech
+NOISE_MARGIN_DB = 10.0  # speech must be this much louder than the noise floor
+
+# speech_seconds and speech_ratio of the clip, snr_db: speech energy above the noise floor
+VadResult = namedtuple('VadResult', ['speech_seconds', 'speech_ratio', 'snr_db'])
+
+
+def to_mono(pcm, channels=1):
+    """@returns: 16 bit PCM bytes as mono int16 samples"""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+        samples = samples.astype(np.int32).mean(axis=1).astype(np.int16)
+    return samples
+
+
+def _frame_energies(frames):
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+
+
+class VoiceActivityDetector:
+    """
+    Tells speech from silence and noise frame by frame, with webrtcvad when
+    it is installed and an adaptive energy threshold otherwise.
+    """
+
+    def __init__(self, aggressiveness=2):
+        self._vad = webrtcvad.Vad(aggressiveness) if webrtcvad is not None else None
+
+    def _frames(self, samples, rate):
+        size = rate * FRAME_MS // 1000
+        count = len(samples) // size
+        return samples[:count * size].reshape(count, size)
+
+    def speech_frames(self, pcm, rate, channels=1):
+        """@returns: (frames as a 2d int16 array, boolean speech flag per frame)"""
+        samples = to_mono(pcm, channels)
+        if self._vad is not None and rate not in WEBRTC_RATES:
+            positions = np.arange(0, len(samples), rate / 16000)
+            samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+            rate = 16000
+        frames = self._frames(samples, rate)
+        if len(frames) == 0:
+            return frames, np.zeros(0, dtype=bool)
+        if self._vad is not None:
+            flags = np.array([self._vad.is_speech(frame.tobytes(), rate) for frame in frames])
+        else:
+            energies = _frame_energies(frames)
+            noise_floor = np.percentile(energies, 10)
+            flags = energies > max(noise_floor + NOISE_MARGIN_DB, MIN_ENERGY_DB)
+        return frames, flags
+
+    def analyze(self, pcm, rate, channels=1):
+        """@returns: VadResult of the 16 bit PCM clip"""
+        frames, flags = self.speech_frames(pcm, rate, channels)
+        if not flags.any():
+            return VadResult(0.0, 0.0, 0.0)
+        energies = _frame_energies(frames)
+        noise = energies[~flags] if (~flags).any() else np.array([np.percentile(energies, 10)])
+        snr_db = float(np.mean(energies[flags]) - np.mean(noise))
+        speech_seconds = int(flags.sum()) * FRAME_MS / 1000
+        return VadResult(speech_seconds, float(flags.mean()), max(snr_db, 0.0))
+
+    def has_speech(self, pcm, rate, channels=1, min_seconds=0.5):
+        return self.analyze(pcm, rate, channels).speech_seconds >= min_seconds
@@ -1,70 +1,396 @@
 #!/home/fantucci/robot/.venv/bin/python3
 
-import os.path
+import os
 import random
 import sys
+import threading
+import wave
+from contextlib import contextmanager
 
 import mpv
+import numpy as np
 from gtts import gTTS, gTTSError
 from termcolor import cprint
 
 import config_manager
+import network_monitor
 import notifier
+from audio_output import NORMAL, URGENT, AudioScheduler
+from sampling_profiler import profiled
+from tts_backends import GTTSBackend, SynthesisError, SynthesisRouter, create_local_backend
+from tts_cache import TTSCache
 
-internet = False
+internet = True
 
-wroteLiveModeSpeech = False
-wroteExecutionSpeech = False
-wroteExitingSpeech = False
-wroteTranscriptionSpeech = False
+LANGUAGE = 'en'
 
+tts_cache = None
+
+EARCON_FILE = 'misc/earcon.wav'  # acknowledgement chime of the continuous capture
+EARCON_GROUP = 'earcon'
+
+router = None
+
+# phrases to pre-synthesize, warmed up again whenever the network comes back
+_warm_up_phrases = []
+
+# python:// stream currently registered with mpv, as (name, reader, stream)
+_stream_lock = threading.Lock()
+_stream_count = 0
+_active_stream = None
+
+output = None
+
+# created with the player thread, the assistant daemon only synthesizes and never needs it
 player = None
-try:
-    player = mpv.MPV(ytdl=True)  # using mpv
-except Exception:
-    cprint("voice feedback requires mpv media player installed on your distro!", "red")
 
+# speech of the daemon session served by the current thread, see capture_speech
+_speech_capture = threading.local()
 
-# initialized voice control to check network state
+
+# initialized voice control to follow the network state
 def init():
     global internet
-    internet = check_network()
+    internet = network_monitor.subscribe(_on_network_change)
 
 
-# handling voice feedback
-def speak(text, wait=False):
-    if not config_manager.config['voice-feedback-enabled']:
-        return
+# picks the cloud or the local engine as connectivity changes
+def _on_network_change(online):
+    global internet
+    internet = online
+    if online and _warm_up_phrases:
+        warm_up_cache(_warm_up_phrases)
+
+
+# content-addressed cache of synthesized speech, created on first use
+def get_cache():
+    global tts_cache
+    if tts_cache is None:
+        max_mb = config_manager.config.get('voice-cache-max-mb', 100)
+        tts_cache = TTSCache(max_bytes=max_mb * 1024 * 1024)
+    return tts_cache
+
+
+# picks the synthesis backend for each phrase, created on first use
+def get_router():
+    global router
+    if router is None:
+        local = create_local_backend(config_manager.config.get('tts-local-backend', 'espeak-ng'),
+                                     config_manager.config.get('tts-piper-model'))
+        router = SynthesisRouter(GTTSBackend(), local, config_manager.config.get('tts-local-max-chars', 40))
+    return router
+
+
+# returns the cached clip of the text, or None
+def _cached_speech(text):
+    if not config_manager.config['voice-cache-enabled']:
+        return None
+    for backend in get_router().route(text, internet):
+        filename = get_cache().get(text, LANGUAGE, config_manager.config['voice-feedback-speed'], backend.name)
+        if filename is not None:
+            return filename
+    return None
+
+
+class _SpeechStream:
+    """
+    Audio chunks fed to mpv while they are still being synthesized. The
+    chunks are kept, since mpv may reopen a stream while probing it; once
+    the source is exhausted the whole clip is handed to @on_complete.
+    """
+
+    def __init__(self, chunks, backend=None, on_complete=None):
+        self.backend = backend
+        self._source = chunks
+        self._chunks = []
+        self._finished = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._on_complete = on_complete
+
+    def _chunk(self, index):
+        with self._lock:
+            while index >= len(self._chunks) and not self._finished:
+                if self._closed:
+                    self._source.close()
+                    self._finished = True
+                    break
+                try:
+                    self._chunks.append(next(self._source))
+                except StopIteration:
+                    self._finished = True
+                    if self._on_complete is not None:
+                        self._on_complete(b"".join(self._chunks))
+                except SynthesisError as e:
+                    # The beginning is playing already, the phrase is just cut short
+                    self._finished = True
+                    self.backend.last_error = e
+                    print(f"📢 {self.backend.name} synthesis failed: {e}", file=sys.stderr)
+            return self._chunks[index] if index < len(self._chunks) else None
+
+    def chunks(self):
+        index = 0
+        while True:
+            chunk = self._chunk(index)
+            if chunk is None:
+                return
+            yield chunk
+            index += 1
+
+    def close(self):
+        """Stops synthesizing, without waiting for a chunk being read on mpv's thread."""
+        self._closed = True
+        if self._lock.acquire(blocking=False):
+            try:
+                self._source.close()
+                self._finished = True
+            finally:
+                self._lock.release()
+
+
+def _apply_player_settings():
     player.speed = config_manager.config['voice-feedback-speed']
-    
 # Uncomment the line below for a higher volume
     player.af = "lavfi=[volume=10]"
-    
+
+
+# plays @stream through mpv's python:// protocol, so playback starts with the
+# first chunk and nothing is written to disk
+def _play_stream(stream, job):
+    global _stream_count, _active_stream
+    def reader():
+        yield from stream.chunks()
+
+    with _stream_lock:
+        _stream_count += 1
+        name = f'speech-{_stream_count}'
+        player.python_stream(name)(reader)
+        previous, _active_stream = _active_stream, (reader, stream)
+    if previous is not None:
+        previous_reader, previous_stream = previous
+        previous_reader.unregister()
+        previous_stream.close()
+    if job.interrupted:
+        stream.close()
+        return
+    player.play(f'python://{name}')
+    player.wait_for_playback()
+
+
+# plays a clip: the path of a cached file or audio bytes in memory
+def _play_clip(clip, job):
+    if isinstance(clip, bytes):
+        _play_stream(_SpeechStream(chunk for chunk in (clip,)), job)
+        return
+    if job.interrupted:
+        return
+    player.play(clip)
+    player.wait_for_playback()
+
+
+# returns the callback storing a completely synthesized phrase in the cache
+def _cache_writer(text, backend):
+    if not config_manager.config['voice-cache-enabled']:
+        return None
+    speed = config_manager.config['voice-feedback-speed']
+    return lambda data: get_cache().put(text, LANGUAGE, speed, backend.name, data, backend.extension)
+
+
+# single player thread all voice feedback goes through, created on first use
+def get_output():
+    global output, player
+    if output is None:
+        try:
+            player = mpv.MPV(ytdl=True)  # using mpv
+        except Exception:
+            cprint("voice feedback requires mpv media player installed on your distro!", "red")
+        output = AudioScheduler(stop_playback)
+    return output
+
+
+# collects what speak() says on this thread as audio clips instead of playing it,
+# each clip a dict with the text, the audio bytes and their file extension
+@contextmanager
+def capture_speech():
+    previous = getattr(_speech_capture, 'clips', None)
+    clips = []
+    _speech_capture.clips = clips
     try:
-        speech = gTTS(text=text, lang='en', slow=False)
-        speech.save('misc/last-feedback-speech.mp3')
-        player.play('misc/last-feedback-speech.mp3')
-        if wait:
-            player.wait_for_playback()
-        return speech
-    except gTTSError as e:
-        if str(e).find('Failed to connect') >= 0:
-            player.play('misc/network-error.mp3')
-            player.wait_for_playback()
-            print("📢 Network connection is required for voice feedback!", file=sys.stderr)
-        else:
-            player.play('misc/internal-voice-feedback-error.mp3')
-            player.wait_for_playback()
-            config_manager.config['voice-feedback-enabled'] = False
-            notifier.notify('Voice-Feedback failed, See logs!', force=True)
-            print(e)
+        yield clips
+    finally:
+        _speech_capture.clips = previous
+
+
+def capturing_speech():
+    return getattr(_speech_capture, 'clips', None) is not None
+
+
+# synthesizes the whole text, going through the cache when enabled
+# @returns (audio bytes, file extension), (None, None) if every backend failed
+@profiled('tts')
+def synthesize_audio(text):
+    cached = _cached_speech(text)
+    if cached is not None:
+        with open(cached, 'rb') as file:
+            return file.read(), os.path.splitext(cached)[1]
+    backend, data = get_router().synthesize(text, LANGUAGE, internet)
+    if backend is None:
+        return None, None
+    if config_manager.config['voice-cache-enabled']:
+        speed = config_manager.config['voice-feedback-speed']
+        get_cache().put(text, LANGUAGE, speed, backend.name, data, backend.extension)
+    return data, backend.extension
+
+
+# handling voice feedback: queues the text and returns at once unless @wait,
+# @priority is one of audio_output.URGENT, NORMAL or ANSWER
+def speak(text, wait=False, priority=NORMAL):
+    if not config_manager.config['voice-feedback-enabled']:
+        return
+    clips = getattr(_speech_capture, 'clips', None)
+    if clips is not None:
+        data, extension = synthesize_audio(text)
+        if data is not None:
+            clips.append({'text': text, 'audio': data, 'extension': extension})
+        return
+    job = get_output().submit(('speech', text), lambda job: _speak_now(text, job), priority)
+    if wait:
+        job.wait()
+
+
+# synthesizes and plays the text on the player thread
+@profiled('tts')
+def _speak_now(text, job):
+    _apply_player_settings()
+
+    # Cached phrases play instantly, even offline
+    cached = _cached_speech(text)
+    if cached is not None:
+        _play_clip(cached, job)
+        return
+
+    backend, chunks = get_router().stream(text, LANGUAGE, internet)
+    if backend is not None:
+        _play_stream(_SpeechStream(chunks, backend, _cache_writer(text, backend)), job)
+        return
+
+    error = get_router().cloud.last_error
+    if error is None or str(error).find('Failed to connect') >= 0:
+        network_monitor.monitor.recheck()
+        player.play('misc/network-error.mp3')
+        player.wait_for_playback()
+        print("📢 Network connection is required for voice feedback!", file=sys.stderr)
+    else:
+        player.play('misc/internal-voice-feedback-error.mp3')
+        player.wait_for_playback()
+        config_manager.config['voice-feedback-enabled'] = False
+        notifier.notify('Voice-Feedback failed, See logs!', force=True)
+        print(error)
+
+
+# synthesizes the whole text without playing it, going through the cache when enabled
+# @returns the path of the cached clip or the audio bytes, None if every backend failed
+@profiled('tts')
+def synthesize(text):
+    cached = _cached_speech(text)
+    if cached is not None:
+        return cached
+    backend, data = get_router().synthesize(text, LANGUAGE, internet)
+    if backend is None:
+        return None
+    if config_manager.config['voice-cache-enabled']:
+        speed = config_manager.config['voice-feedback-speed']
+        return get_cache().put(text, LANGUAGE, speed, backend.name, data, backend.extension)
+    return data
+
+
+# pre-synthesizes static phrases in the background so they play instantly later
+def warm_up_cache(phrases):
+    global _warm_up_phrases
+    if not config_manager.config['voice-cache-enabled']:
+        return None
+    _warm_up_phrases = list(phrases)
+    if not internet and get_router().local is None:
+        return None  # nothing can synthesize them, wait for the network
+    router = get_router()
+    unique = [(phrase, [backend.name for backend in router.route(phrase)])
+              for phrase in dict.fromkeys(phrases) if phrase]
+
+    def synthesize_phrase(text):
+        backend, data = router.synthesize(text, LANGUAGE, internet)
+        if backend is None:
+            return None, None, None
+        return backend.name, data, backend.extension
+
+    return get_cache().warm_up(unique, LANGUAGE, config_manager.config['voice-feedback-speed'], synthesize_phrase)
+
+
+# queues an already synthesized clip (see synthesize) with the voice feedback settings,
+# @group lets cancel_speech drop all clips queued by one caller
+def play_clip(clip, wait=False, priority=NORMAL, group=None):
+    if not config_manager.config['voice-feedback-enabled']:
+        return None
+
+    def play(job):
+        _apply_player_settings()
+        _play_clip(clip, job)
+
+    job = get_output().submit(('clip', clip), play, priority, group)
+    if wait:
+        job.wait()
+    return job
+
+
+# short two-note chime acknowledging the hot word, generated once
+# @returns: the path of the WAV file
+def get_earcon():
+    if not os.path.exists(EARCON_FILE):
+        os.makedirs(os.path.dirname(EARCON_FILE), exist_ok=True)
+        rate = 22050
+        seconds = np.arange(int(rate * 0.08)) / rate
+        notes = [np.sin(2 * np.pi * frequency * seconds) * np.hanning(len(seconds)) for frequency in (880, 1320)]
+        samples = (np.concatenate(notes) * 0.4 * 32767).astype(np.int16)
+        temporary = EARCON_FILE + '.tmp'
+        with wave.open(temporary, 'wb') as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(rate)
+            file.writeframes(samples.tobytes())
+        os.replace(temporary, EARCON_FILE)
+    return EARCON_FILE
+
+
+# plays the acknowledgement chime without waiting for it
+def play_earcon():
+    return play_clip(get_earcon(), priority=URGENT, group=EARCON_GROUP)
+
+
+# True while the voice feedback plays anything but the earcon, which the command may overlap
+def is_speaking():
+    job = output.current if output is not None else None
+    return job is not None and job.group is not EARCON_GROUP
+
+
+# drops the queued speech of @group, or everything when no group is given
+def cancel_speech(group=None):
+    if output is None:
+        return
+    if group is None:
+        output.flush()
+    else:
+        output.cancel_group(group)
+
+
+# stops the voice feedback currently playing, if any
+def stop_playback():
+    if player is not None:
+        player.stop()
 
 
 # internal function to create default voice feedbacks
 def _speak_and_save(text, filename):
-    player.speed = config_manager.config['voice-feedback-speed']
     try:
-        speech = gTTS(text=text, lang='en', slow=False)
+        speech = gTTS(text=text, lang=LANGUAGE, slow=False)
         speech.save(filename)
     except gTTSError as ex:
         print(ex)
@@ -74,78 +400,39 @@ def _speak_and_save(text, filename):
 def give_execution_feedback():
     if len(config_manager.config['voice-feedback-default-speeches']) == 0:
         return
-    global wroteExecutionSpeech
-    if internet and not wroteExecutionSpeech:
-        speech = speak(random.choice(config_manager.config['voice-feedback-default-speeches']), wait=True)
-        if config_manager.config['voice-cache-enabled']:
-            speech.save('misc/execution-feedback.mp3')
-            wroteExecutionSpeech = True
-    elif os.path.exists('misc/execution-feedback.mp3'):
-        player.speed = config_manager.config['voice-feedback-speed']
-        player.play('misc/execution-feedback.mp3')
-        player.wait_for_playback()
+    speak(random.choice(config_manager.config['voice-feedback-default-speeches']), wait=True)
+
 
 # voice feedback when exiting
 def give_exiting_feedback():
-    global wroteExitingSpeech
-    if internet and not wroteExitingSpeech:
-        speech = speak(config_manager.config['voice-feedback-turning-off'], wait=True)
-        if config_manager.config['voice-cache-enabled']:
-            speech.save('misc/exiting-feedback.mp3')
-            wroteExitingSpeech = True
-    elif os.path.exists('misc/exiting-feedback.mp3'):
-        player.speed = config_manager.config['voice-feedback-speed']
-        player.play('misc/exiting-feedback.mp3')
-        player.wait_for_playback()
+    speak(config_manager.config['voice-feedback-turning-off'], wait=True)
+
 
 # voice feedback when initializing live mode
 def give_live_mode_feedback():
-    global wroteLiveModeSpeech
-    if internet and not wroteLiveModeSpeech:
-        speech = speak("voice control is running in live mode.", wait=False)
-        if config_manager.config['voice-cache-enabled']:
-            speech.save('misc/live_mode-feedback.mp3')
-            wroteLiveModeSpeech = True
-    elif os.path.exists('misc/live_mode-feedback.mp3'):
-        player.speed = config_manager.config['voice-feedback-speed']
-        player.play('misc/live_mode-feedback.mp3')
+    speak("voice control is running in live mode.", wait=False)
 
 
 # required for live voice control
 def give_transcription_feedback():
     if len(config_manager.config['voice-feedback-transcription-capable-speeches']) == 0:
         return
-    global wroteTranscriptionSpeech
     if config_manager.config['voice-transcription-feedback-enabled']:
-        if internet and not wroteTranscriptionSpeech:
-            speech = speak(random.choice(config_manager.config['voice-feedback-transcription-capable-speeches']))
-            if config_manager.config['voice-cache-enabled']:
-                speech.save('misc/transcription-feedback.mp3')
-                wroteTranscriptionSpeech = True
-        elif os.path.exists('misc/transcription-feedback.mp3'):
-            player.speed = config_manager.config['voice-feedback-speed']
-            player.play('misc/transcription-feedback.mp3')
-
-
-# checks if network is reachable
-def check_network():
-    try:
-        gTTS(text='checking network connectivity ...', lang='en', slow=False).save('misc/network-test.mp3')
-        return True
-    except gTTSError:
-        return False
+        speak(random.choice(config_manager.config['voice-feedback-transcription-capable-speeches']))
+
+
+# phrases spoken by the voice feedback itself, pre-synthesized at startup
+def get_static_speeches():
+    return [config_manager.config['greeting'],
+            config_manager.config['voice-feedback-turning-off'],
+            "voice control is running in live mode."] \
+        + config_manager.config['voice-feedback-default-speeches'] \
+        + config_manager.config['voice-feedback-transcription-capable-speeches']
 
 
 # voice greeting
 def greet():
-    if internet:
-        speech = speak(config_manager.config['greeting'], wait=True)
-        if config_manager.config['voice-cache-enabled']:
-            speech.save('misc/greeting.mp3')
-    else:
-        player.speed = config_manager.config['voice-feedback-speed']
-        player.play('misc/greeting.mp3')
-        player.wait_for_playback()
+    speak(config_manager.config['greeting'], wait=True)
 
 
 # generates and saves default voice feedbacks
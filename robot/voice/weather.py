@@ -1,5 +1,6 @@
 import requests
 import os
+import network_monitor
 from voice_feedback import speak  # Import the speak function
 from dotenv import load_dotenv
 
@@ -8,10 +9,22 @@ load_dotenv()
 # Your OpenWeatherMap API Key
 API_KEY = os.getenv("WEATHER_API_KEY")
 
+def _on_network_change(state):
+    global online
+    online = state
+
+# Connectivity as last reported by the network monitor
+online = network_monitor.subscribe(_on_network_change)
+
 def get_weather(city=None, language="en"):
     """
     Fetches weather conditions for the current location or a specific city and speaks them.
     """
+    if not online:
+        error_message = "I need a network connection to check the weather."
+        speak(error_message)
+        return error_message
+
     if not city:
         # Try to get the current location based on IP
         try: